@@ -1,3 +1,5 @@
 # coding: utf-8
 
-from .core import depend_on, with_setup
+from .core import depend_on, module_depend_on, uses, with_setup
+from .fixtures import fixture, use_fixtures
+from .timeout import timeout
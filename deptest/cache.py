@@ -0,0 +1,102 @@
+# coding: utf-8
+
+"""On disk store that persists between runs
+"""
+
+import os
+import errno
+import hashlib
+import inspect
+import logging
+import cPickle as pickle
+
+lg = logging.getLogger('deptest.cache')
+
+
+CACHE_DIR = '.deptest_cache'
+
+# written into a new cache dir, to keep it out of version control
+GITIGNORE = '# created by deptest\n*\n'
+
+
+class Cache(object):
+    """Pickled values in files under `dirpath`, a key is the relative path
+    of the file, like `results/<hash>`
+    """
+
+    def __init__(self, dirpath=CACHE_DIR):
+        self.dirpath = dirpath
+
+    def _path(self, key):
+        return os.path.join(self.dirpath, *key.split('/'))
+
+    def get(self, key, default=None):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return pickle.load(f)
+        except IOError:
+            return default
+        except Exception as e:
+            lg.debug('broken cache %s: %s', key, e)
+            return default
+
+    def set(self, key, value):
+        if not os.path.isdir(self.dirpath):
+            self._create()
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        # write to a temporary file first, so that readers never see
+        # a partially written value
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        os.rename(tmp_path, path)
+
+    def _create(self):
+        try:
+            os.makedirs(self.dirpath)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            return
+        with open(os.path.join(self.dirpath, '.gitignore'), 'w') as f:
+            f.write(GITIGNORE)
+
+
+def hash_file(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def hash_source(func):
+    try:
+        source = inspect.getsource(func)
+    except (IOError, TypeError):
+        source = func.__code__.co_code
+    return hashlib.sha1(source).hexdigest()
+
+
+def entry_keys(graph, module_hashes):
+    """Key of each entry in `graph`, changes when the source of the entry,
+    the file of its module or the key of any of its dependencies changes
+    """
+    keys = {}
+    for entry in graph.order:
+        h = hashlib.sha1()
+        h.update(hash_source(entry))
+        h.update(module_hashes[entry._module_runner])
+        for dep in graph.dependencies[entry]:
+            h.update(keys[dep])
+        keys[entry] = h.hexdigest()
+    return keys
@@ -0,0 +1,192 @@
+# coding: utf-8
+
+"""Output capturing helpers
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import itertools
+import collections
+from StringIO import StringIO
+
+
+class ThreadLocalStdout(object):
+    """Stand-in for `sys.stdout` when entries run in multiple threads.
+
+    Each thread pushes its own buffer, writes go to the top buffer of the
+    current thread, or to the real stdout if the thread captures nothing.
+    """
+
+    def __init__(self, stdout):
+        self.stdout = stdout
+        self._local = threading.local()
+
+    @property
+    def _buffers(self):
+        try:
+            return self._local.buffers
+        except AttributeError:
+            self._local.buffers = []
+            return self._local.buffers
+
+    def push(self, buf):
+        self._buffers.append(buf)
+
+    def pop(self):
+        return self._buffers.pop()
+
+    @property
+    def target(self):
+        buffers = self._buffers
+        if buffers:
+            return buffers[-1]
+        return self.stdout
+
+    def write(self, s):
+        self.target.write(s)
+
+    def writelines(self, lines):
+        self.target.writelines(lines)
+
+    def flush(self):
+        self.target.flush()
+
+    # `print` statement keeps its state on the file object, delegate it
+    # so that threads don't share it
+    @property
+    def softspace(self):
+        return getattr(self.target, 'softspace', 0)
+
+    @softspace.setter
+    def softspace(self, value):
+        self.target.softspace = value
+
+    def __getattr__(self, name):
+        return getattr(self.target, name)
+
+
+class CaptureBuffer(object):
+    """File like buffer that keeps up to `max_size` bytes in memory, and
+    spills everything to a temporary file beyond that
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self._buf = StringIO()
+        self._file = None
+
+    def write(self, s):
+        if isinstance(s, unicode):
+            s = s.encode('utf-8')
+        self.size += len(s)
+        if self._file is None and self.size > self.max_size:
+            self._file = tempfile.TemporaryFile()
+            self._file.write(self._buf.getvalue())
+            self._buf = None
+        (self._file or self._buf).write(s)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+    def getvalue(self, head=0, tail=0):
+        return read_captured(self._file or self._buf, head, tail)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        self._buf = self._file = None
+
+
+class EncodedFile(object):
+    """Writes to file `f`, unicode is encoded to utf-8 like in
+    CaptureBuffer
+    """
+
+    encoding = 'utf-8'
+
+    def __init__(self, f):
+        self.file = f
+
+    def write(self, s):
+        if isinstance(s, unicode):
+            s = s.encode('utf-8')
+        self.file.write(s)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+class FDCapture(object):
+    """Redirect file descriptors of stdout and stderr to a temporary file,
+    so that output of subprocesses and C extensions is captured too
+    """
+
+    fds = (1, 2)
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        # unbuffered file on the redirected stdout, to be used as
+        # `sys.stdout` so that prints keep their order with other writes
+        self.stdout = None
+        self._saved = None
+
+    def start(self):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        self._saved = [os.dup(fd) for fd in self.fds]
+        for fd in self.fds:
+            os.dup2(self.file.fileno(), fd)
+        self.stdout = EncodedFile(os.fdopen(os.dup(self.fds[0]), 'w', 0))
+
+    def stop(self):
+        self.stdout.close()
+        sys.stderr.flush()
+        for fd, saved in zip(self.fds, self._saved):
+            os.dup2(saved, fd)
+            os.close(saved)
+        self._saved = None
+
+    def getvalue(self, head=0, tail=0):
+        return read_captured(self.file, head, tail)
+
+    def close(self):
+        self.file.close()
+
+
+def read_captured(f, head=0, tail=0):
+    """Returns the text captured in file `f`, if `head` or `tail` is given
+    only that many lines from the start and the end are kept
+    """
+    f.seek(0)
+    try:
+        if not head and not tail:
+            return f.read()
+
+        lines = iter(f)
+        head_lines = list(itertools.islice(lines, head))
+        tail_lines = collections.deque(maxlen=tail)
+        skipped = 0
+        for line in lines:
+            tail_lines.append(line)
+            skipped += 1
+        skipped -= len(tail_lines)
+
+        if skipped:
+            head_lines.append('... {} lines truncated ...\n'.format(skipped))
+        return ''.join(head_lines) + ''.join(tail_lines)
+    finally:
+        f.seek(0, os.SEEK_END)
@@ -3,15 +3,44 @@
 import os
 import re
 import sys
+import json
+import time
 import inspect
+import functools
+import contextlib
 import logging
+import linecache
+import fnmatch
 import argparse
 import traceback
+import threading
+import multiprocessing
+from Queue import Queue
 from StringIO import StringIO
 from collections import defaultdict
-
-from .loader import load_module_from_path
-from .utils import ln, hr, safe_str, merge_list, ObjectDict
+from multiprocessing.pool import ThreadPool
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+from .loader import (
+    load_module_from_path, may_define_entries, static_module_from_path, MODULE_DEPENDENCIES_ATTR)
+from .graph import DependencyGraph
+from .scheduler import Scheduler, partition, merge_conflicting, select_within_budget
+from .capture import ThreadLocalStdout, CaptureBuffer, FDCapture
+from .cache import Cache, hash_file, hash_source, entry_keys
+from .reporters import make_record, JSONLinesReporter, JUnitXMLReporter
+from .watch import FileWatcher, module_source
+from .store import ReturnStore
+from .state import EntryState, StateTable, OK, FAILED, UNMET, STATUS_NAMES
+from .fixtures import FixtureManager, FixtureScope
+from .timeout import Watchdog, EntryTimeout
+from .tools import with_setup
+from .utils import ln, hr, safe_str, ObjectDict, wall_time, cpu_time, timed
 from .log import setup_log_handler, MyMemoryHandler, set_logger, color
 from .config_object import Config
 
@@ -20,8 +49,6 @@ lg = logging.getLogger('deptest')
 
 config = Config()
 
-STATUS_NAMES = ['OK', 'FAILED', 'UNMET']
-
 STATUS_COLORS = {
     'OK': 'green',
     'FAILED': 'red',
@@ -36,13 +63,8 @@ class ModuleRunner(object):
     module_setup_pattern = re.compile(r'^global_setup$')
     module_teardown_pattern = re.compile(r'^global_teardown$')
 
-    def __init__(self, path):
-        # parse path
-        if ':' in path:
-            module_path, entry_name = tuple(path.split(':'))
-        else:
-            module_path, entry_name = path, None
-        lg.debug('module_path: {}, entry_name: {}'.format(module_path, entry_name))
+    def __init__(self, module_path, suite):
+        lg.debug('module_path: {}'.format(module_path))
         module = self.load_module(module_path)
 
         entries = []
@@ -57,11 +79,17 @@ class ModuleRunner(object):
             if self.entry_pattern.match(name):
                 lg.debug('match entry %s', name)
 
+                # entry imported from another test module belongs to that module
+                if getattr(attr, '_module_runner', None) is not None:
+                    lg.debug('skip entry %s imported from %s', name, attr._module_runner)
+                    continue
+
                 # add essential attributes for entry
                 if not hasattr(attr, 'dependencies'):
                     attr.dependencies = []
 
                 attr._entry_name = name
+                attr._module_runner = self
                 entries.append(attr)
                 entries_dict[name] = attr
                 continue
@@ -80,73 +108,658 @@ class ModuleRunner(object):
 
         self.entries = entries
         self.entries_dict = entries_dict
-        self._traverse_entries()
+        self.module_dependencies = getattr(module, MODULE_DEPENDENCIES_ATTR, [])
 
         self.module_setup = module_setup
         self.module_teardown = module_teardown
         self.module = module
         self.module_path = module_path
+        self.suite = suite
+
+        # entries selected from command line, dependencies are added
+        # by the suite
+        self.entries_to_run = []
 
-        # filter entries
+    def load_module(self, path):
+        module = load_module_from_path(path)
+        lg.debug('ModuleRunner init: %s', module)
+        return module
+
+    def select(self, entry_name=None):
         if entry_name:
-            _entries_to_run = set([self.entries_dict[entry_name]])
-            # make sure each entry in pendings got their deps
-            for i in list(_entries_to_run):
-                deps = traverse_entry_dependencies(i, self.entries_dict)
-                _entries_to_run |= set(deps)
-            self.entries_to_run = list(_entries_to_run)
+            entries = [self.entries_dict[entry_name]]
         else:
-            self.entries_to_run = self.entries
+            entries = self.entries
             # TODO tag support
+        for entry in entries:
+            if entry not in self.entries_to_run:
+                self.entries_to_run.append(entry)
 
-        lg.debug('entries to run: %s', [i._entry_name for i in self.entries_to_run])
+    def referenced_modules(self):
+        """Names of other modules this module depends on"""
+        names = list(self.module_dependencies)
+        for entry in self.entries:
+            for i in entry.dependencies:
+                if ':' in i['name']:
+                    names.append(i['name'].split(':', 1)[0])
+        return names
+
+    def __str__(self):
+        return '<ModuleRunner: {}>'.format(self.module.__name__)
+
+
+class StaticModuleRunner(ModuleRunner):
+    """Get entries and dependencies by parsing the module instead of
+    running it, the module is only imported when they are dynamic
+    """
 
     def load_module(self, path):
-        module = load_module_from_path(path)
-        lg.debug('ModuleRunner init: %s', module)
+        module = static_module_from_path(path, self.entry_pattern)
+        if module is None:
+            lg.info('dependencies in %s are dynamic, import it to collect', path)
+            return super(StaticModuleRunner, self).load_module(path)
+        lg.debug('StaticModuleRunner init: %s', module)
         return module
 
-    def _traverse_entries(self):
-        lg.debug('entries_dict: %s', self.entries_dict)
-        for entry in self.entries:
-            deps = traverse_entry_dependencies(entry, self.entries_dict)
-            lg.debug('entry {} depend on {}'.format(entry._entry_name, deps))
 
-    def dispatch(self):
-        lg.debug('ModuleRunner dispatch')
-        states = defaultdict(new_state)
-        self.states = states
-        self._dispatch(self.entries_to_run, states)
+class SuiteRunner(object):
+    """Runs the entries of all the modules with one dependency graph, so
+    that entries can depend on entries in other modules
+    """
+
+    def __init__(self, runner_class=ModuleRunner):
+        self.runner_class = runner_class
+        self.runners = []
+        self.runners_by_path = {}
+        self.runners_by_name = {}
+        self.cache = Cache()
+        # statuses of the last runs, by full name of the entry
+        self.history = self.cache.get('history', {})
+        # entries scheduled first, by `--ff`
+        self.priorities = {}
+        self.reporters = []
+        # whether captured output of passing entries is needed, decided
+        # by `dispatch` before worker processes drop the reporters
+        self.keep_output = False
+        # set in worker processes, which send states back to the parent
+        self.in_worker = False
+        # set when entries run in parallel, start and end of an entry
+        # are then logged together
+        self.print_lock = None
+        self.watchdog = Watchdog()
+        # wall time when --global-timeout is reached
+        self.deadline = None
+        # queue of finished entries when they run in threads
+        self._finished = None
+        # failures of the current run, for --maxfail, shared by worker
+        # processes in a `multiprocessing.Value`
+        self.failures = 0
+        self._shared_failures = None
+        # entries left when --maxfail is reached
+        self.not_run = []
+
+    def add_path(self, path):
+        # parse path
+        if ':' in path:
+            module_path, entry_name = tuple(path.split(':'))
+        else:
+            module_path, entry_name = path, None
+        lg.debug('module_path: {}, entry_name: {}'.format(module_path, entry_name))
+        runner = self.get_runner(module_path)
+        runner.select(entry_name)
+
+    def get_runner(self, module_path):
+        key = os.path.abspath(module_path)
+        if key not in self.runners_by_path:
+            self.add_runner(self.runner_class(module_path, self))
+        return self.runners_by_path[key]
+
+    def add_runner(self, runner):
+        self.runners.append(runner)
+        self.runners_by_path[os.path.abspath(runner.module_path)] = runner
+        self.runners_by_name.setdefault(runner.module.__name__, runner)
+
+    def get_runner_by_name(self, name, near):
+        """Get the runner of module `name`, a module not loaded yet is
+        looked up in the directory of runner `near`
+        """
+        if name not in self.runners_by_name:
+            module_path = os.path.join(os.path.dirname(near.module_path), name + '.py')
+            if not os.path.isfile(module_path):
+                raise ValueError('module not found: {} depend on {}'.format(near.module.__name__, name))
+            self.get_runner(module_path)
+        return self.runners_by_name[name]
+
+    def prepare(self):
+        # load every module that is depended on, even if not selected
+        for runner in self.runners:
+            for name in runner.referenced_modules():
+                self.get_runner_by_name(name, runner)
+
+        entries = []
+        for runner in self.runners:
+            entries.extend(runner.entries)
+        self.graph = DependencyGraph(entries, self.resolve)
+        self._traverse_entries()
 
-    def _dispatch(self, entries, states):
-        lg.debug('_dispatch')
-        pendings = []
+        # make sure selected entries got their deps
+        selected = []
+        for runner in self.runners:
+            selected.extend(runner.entries_to_run)
+        self.entries_to_run = self.graph.sorted(self.graph.closure_of(selected))
+
+        if config.last_failed or config.failed_first:
+            failed = [i for i in self.entries_to_run
+                      if self.history.get(full_name(i), {}).get('status') in ('FAILED', 'UNMET')]
+            lg.debug('last failed: %s', [i._entry_name for i in failed])
+            # run everything if nothing failed last time
+            if failed:
+                failed_closure = self.graph.closure_of(failed)
+                if config.last_failed:
+                    self.entries_to_run = self.graph.sorted(failed_closure)
+                else:
+                    for entry in self.entries_to_run:
+                        self.priorities[entry] = 0 if entry in failed_closure else 1
+
+        if config.shard_count > 1:
+            self.entries_to_run = self.graph.sorted(self.shard(config.shard_index, config.shard_count))
+
+        if config.time_budget is not None:
+            self.entries_to_run = self.graph.sorted(self.select_within_budget(config.time_budget))
 
-        for entry in entries:
-            deps = traverse_entry_dependencies(entry, self.entries_dict)
-            state = states[entry]
-            if deps:
-                if should_unmet(deps, states):
-                    set_state(state, 'unmet', True)
-                elif should_pending(deps, states):
-                    lg.debug('%s PENDING', entry)
-                    pendings.append(entry)
-                    continue
+        lg.debug('entries to run: %s', [i._entry_name for i in self.entries_to_run])
 
-            self.run_entry(entry, states)
+    def shard(self, index, count):
+        """Entries of shard `index`. Connected components of the graph are
+        never split, and are distributed by their durations in history,
+        entries never run before count as the average duration
+        """
+        duration = self.history_durations()
 
-        if pendings:
-            lg.debug('pendings: %s', [i._entry_name for i in pendings])
-            self._dispatch(pendings, states)
+        def weight(component):
+            return sum(duration(i) for i in component)
+
+        components = self.graph.components(self.entries_to_run)
+        bins, totals = partition(components, weight, count)
+        lg.debug('shard totals: %s', totals)
+        entries = []
+        for component in bins[index]:
+            entries.extend(component)
+        return entries
+
+    def select_within_budget(self, budget):
+        """Entries that fit in `budget` seconds by their durations in
+        history, entries that did not pass last time are worth the most,
+        then the ones never run
+        """
+        duration = self.history_durations()
+        values = {'FAILED': 4, 'UNMET': 4, None: 2}
+
+        def value(entry):
+            return values.get(self.history.get(full_name(entry), {}).get('status'), 1)
+
+        selected, total = select_within_budget(self.graph, self.entries_to_run, duration, value, budget)
+        lg.info('time budget %.2fs: run %s of %s entries, %.2fs expected',
+                budget, len(selected), len(self.entries_to_run), total)
+        return selected
+
+    def history_durations(self):
+        """Returns a function giving the duration of an entry in history,
+        or the average of `entries_to_run` for an entry never run
+        """
+        durations = {}
+        for entry in self.entries_to_run:
+            duration = self.history.get(full_name(entry), {}).get('duration')
+            if duration is not None:
+                durations[entry] = duration
+        default = sum(durations.values()) / len(durations) if durations else 1.0
+        return lambda entry: durations.get(entry, default)
+
+    def resolve(self, entry):
+        """Returns the entries `entry` depends on, in the order of
+        `entry.dependencies`, followed by the entries of the modules its
+        module depends on
+        """
+        runner = entry._module_runner
+        deps = []
+        for i in entry.dependencies:
+            name = i['name']
+            dep_runner = runner
+            if ':' in name:
+                module_name, name = name.split(':', 1)
+                dep_runner = self.get_runner_by_name(module_name, runner)
+            try:
+                deps.append(dep_runner.entries_dict[name])
+            except KeyError:
+                raise ValueError(
+                    'unknown dependency: {} depend on {}'.format(entry._entry_name, i['name']))
+        for module_name in runner.module_dependencies:
+            for dep in self.get_runner_by_name(module_name, runner).entries:
+                if dep not in deps:
+                    deps.append(dep)
+        return deps
+
+    def _traverse_entries(self):
+        # closures of every entry are only computed for debugging
+        if not lg.isEnabledFor(logging.DEBUG):
+            return
+        for entry in self.graph.entries:
+            lg.debug('entry %s depend on %s', entry._entry_name,
+                     [i._entry_name for i in self.graph.closure(entry)])
+
+    def dispatch(self):
+        lg.debug('SuiteRunner dispatch')
+        self.keep_output = any(i.wants_output for i in self.reporters)
+        self.states = StateTable(self.graph)
+        self.returns = self.new_return_store(self.entries_to_run)
+        if config.incremental:
+            self.load_cached()
+        self.fixtures = FixtureManager(self.entries_to_run)
+        self.start_watchdog(self.entries_to_run)
+        self.failures = 0
+        try:
+            if config.processes > 1:
+                self._dispatch_processes()
+            else:
+                self._dispatch(self.entries_to_run)
+        finally:
+            self.fixtures.teardown_all()
+            self.watchdog.stop()
+        self.not_run = [i for i in self.entries_to_run if not self.states.is_finished(i)]
+
+    def start_watchdog(self, entries):
+        """Start watching for timeouts if any applies to `entries`"""
+        if config.global_timeout:
+            self.deadline = wall_time() + config.global_timeout
+        if self.deadline is not None or config.timeout or any(getattr(i, 'timeout', None) for i in entries):
+            self.watchdog.start()
+
+    def expired(self):
+        """Whether --global-timeout is reached"""
+        return self.deadline is not None and wall_time() > self.deadline
+
+    def max_failed(self):
+        """Whether --maxfail is reached, no more entries are started then"""
+        if not config.maxfail:
+            return False
+        if self._shared_failures is not None:
+            return self._shared_failures.value >= config.maxfail
+        return self.failures >= config.maxfail
+
+    def count_failure(self):
+        self.failures += 1
+        if self._shared_failures is not None:
+            with self._shared_failures.get_lock():
+                self._shared_failures.value += 1
+
+    def _dispatch(self, entries):
+        states = self.states
+        scheduler = Scheduler(self.graph, entries, self.priorities)
+        if config.workers > 1:
+            with threaded_logging():
+                self._dispatch_parallel(scheduler, states)
+            return
+        # `entry_done` marks the entry done in the scheduler
+        entry = scheduler.pop()
+        while entry is not None and not self.max_failed():
+            self.run_entry(entry, states)
+            self.entry_done(entry, scheduler, states)
+            entry = scheduler.pop()
+
+    def _dispatch_parallel(self, scheduler, states):
+        lg.debug('SuiteRunner dispatch with %s workers', config.workers)
+        # create states beforehand, threads only read and update them
+        for entry in scheduler.entries:
+            states[entry]
+
+        # (entry, None) when an entry finishes, (entry, reason) when the
+        # watchdog gives up on it
+        self._finished = finished = Queue()
+
+        def run(entry):
+            try:
+                self.run_entry(entry, states)
+            finally:
+                finished.put((entry, None))
+
+        self.print_lock = threading.Lock()
+        stdout = sys.stdout
+        sys.stdout = ThreadLocalStdout(stdout)
+        running = set()
+        try:
+            while True:
+                # take an entry only when a worker is free, so that it
+                # doesn't hold its resources while waiting
+                while len(running) < config.workers and not self.max_failed():
+                    entry = scheduler.pop()
+                    if entry is None:
+                        break
+                    # a thread for each entry, a hung one can be left behind
+                    thread = threading.Thread(target=run, args=(entry, ), name='deptest-worker')
+                    thread.daemon = True
+                    thread.start()
+                    running.add(entry)
+                if not running:
+                    break
+                entry, reason = finished.get()
+                if entry not in running:
+                    # finished after it was abandoned
+                    continue
+                running.remove(entry)
+                if reason is not None:
+                    self.replace_abandoned(entry, states, reason)
+                self.entry_done(entry, scheduler, states)
+        finally:
+            sys.stdout = stdout
+            self.print_lock = None
+            self._finished = None
+
+    def abandon(self, entry, reason):
+        """Called by the watchdog when `entry` did not stop after it was
+        interrupted, its thread is left running
+        """
+        self._finished.put((entry, reason))
+
+    def replace_abandoned(self, entry, states, reason):
+        # the thread left running may still update the old state
+        state = states[entry] = EntryState()
+        state.executed = True
+        state.traceback = '{}, and did not stop\n'.format(reason)
+        EntryRunner(entry, state, entry._module_runner)._log_end()
+
+    def _dispatch_processes(self):
+        """Run each connected component of the graph in a worker process,
+        components never pass return values to each other, so the values
+        stay in the process that produced them
+        """
+        global _process_suite
+
+        components = merge_conflicting(self.graph.components(self.entries_to_run))
+        if self.priorities:
+            components.sort(key=lambda c: min(self.priorities[i] for i in c))
+        lg.debug('SuiteRunner dispatch %s components with %s processes',
+                 len(components), config.processes)
+
+        # worker processes are forked after this, and inherit the suite
+        _process_suite = self
+        if config.maxfail:
+            self._shared_failures = multiprocessing.Value('i', 0)
+        pool = multiprocessing.Pool(min(config.processes, len(components) or 1))
+        try:
+            tasks = [[self.graph.index[i] for i in c] for c in components]
+            results = pool.imap(_run_component, tasks)
+            for _ in tasks:
+                try:
+                    output, states = results.next(self.cancel_timeout())
+                except multiprocessing.TimeoutError:
+                    self.cancel_processes(pool)
+                    break
+                sys.stdout.write(output)
+                for index, state in states:
+                    entry = self.graph.entries[index]
+                    self.states[entry] = state
+                    self.states.finish(entry)
+                    self.report(entry, state)
+        finally:
+            pool.close()
+            pool.join()
+            _process_suite = None
+            if self._shared_failures is not None:
+                # counted by the workers, for `max_failed` in the summary
+                self.failures = self._shared_failures.value
+            self._shared_failures = None
+
+    def cancel_timeout(self):
+        """Seconds to wait for worker processes, they stop by themselves
+        at the deadline, and are killed if they don't in a while
+        """
+        if self.deadline is None:
+            return None
+        return max(self.deadline + _cancel_grace - wall_time(), 0)
+
+    def cancel_processes(self, pool):
+        lg.error('worker processes did not stop after --global-timeout, kill them')
+        pool.terminate()
+        for entry in self.entries_to_run:
+            if self.states.is_finished(entry):
+                continue
+            state = self.states[entry]
+            # a cached result stands, it's only not reported yet
+            if not state.cached:
+                state.traceback = 'cancelled, --global-timeout reached\n'
+            entry_runner = EntryRunner(entry, state, entry._module_runner)
+            entry_runner.log_state_start()
+            entry_runner.log_state_end()
+            self.states.finish(entry)
+            self.report(entry, state)
+
+    def entry_done(self, entry, scheduler, states):
+        if states[entry].status == FAILED:
+            self.spread_unmet(entry, scheduler.entries, states)
+            self.count_failure()
+        if config.incremental:
+            self.save_cached(entry, states[entry])
+        # from now on the value is only held by the store, which frees it
+        # once the dependents taking it have finished
+        self.returns.put(entry, states[entry].return_value)
+        states[entry].return_value = None
+        for dep, i in zip(self.graph.dependencies[entry], entry.dependencies):
+            if i['with_return']:
+                self.returns.release(dep)
+        self.fixtures.entry_done(entry)
+        states.finish(entry)
+        self.report(entry, states[entry])
+        scheduler.done(entry)
+
+    def new_return_store(self, entries):
+        """Returns a store that keeps a return value until every dependent
+        in `entries` taking it has finished
+        """
+        refcounts = defaultdict(int)
+        for entry in entries:
+            for dep, i in zip(self.graph.dependencies[entry], entry.dependencies):
+                if i['with_return']:
+                    refcounts[dep] += 1
+        # a watched suite runs again with values of entries not changed,
+        # the peak size is only reported by --durations in this process
+        return ReturnStore(
+            refcounts, config.spill_returns, keep=config.watch,
+            measure=bool(config.durations) and config.processes <= 1)
+
+    def report(self, entry, state):
+        """Pass the result of `entry` to the reporters, its output has been
+        printed by then and is not kept any longer
+        """
+        # results of worker processes are reported by the parent
+        if self.in_worker:
+            return
+        if self.reporters:
+            record = make_record(entry, state, state.status_name, self.graph.dependencies[entry])
+            for reporter in self.reporters:
+                reporter.entry_finished(record)
+        state.captured_stdout = None
+        state.captured_logging = None
+
+    def save_history(self):
+        for entry, state in self.states.iteritems():
+            # not run after --maxfail
+            if not self.states.is_finished(entry):
+                continue
+            record = self.history.setdefault(full_name(entry), {})
+            record['status'] = state.status_name
+            # keep the duration of the last execution
+            if state.duration is not None:
+                record['duration'] = state.duration
+        self.cache.set('history', self.history)
+
+    def returns_needed(self, entry):
+        """Whether any dependent takes the return value of `entry`"""
+        for dependent in self.graph.dependents[entry]:
+            for dep, i in zip(self.graph.dependencies[dependent], dependent.dependencies):
+                if dep is entry and i['with_return']:
+                    return True
+        return False
+
+    def load_cached(self):
+        """Mark entries that passed last time and have not changed since
+        as OK, an entry whose return value is needed is only skipped if the
+        value was stored
+        """
+        self.cache_keys = self.get_cache_keys()
+
+        for entry in self.entries_to_run:
+            record = self.cache.get('results/' + self.cache_keys[entry])
+            if record is None:
+                continue
+            if self.returns_needed(entry):
+                if 'return_value' not in record:
+                    continue
+                self.states[entry].return_value = record['return_value']
+            lg.debug('cached %s', entry._entry_name)
+            self.states[entry].cached = True
+            self.states[entry].status = OK
+
+    def get_cache_keys(self):
+        module_hashes = {}
+        for runner in self.runners:
+            module_hashes[runner] = hash_file(runner.module_path)
+        return entry_keys(self.graph, module_hashes)
+
+    def save_cached(self, entry, state):
+        if not state.executed or not state.ok:
+            return
+        key = 'results/' + self.cache_keys[entry]
+        if self.returns_needed(entry):
+            try:
+                self.cache.set(key, {'return_value': state.return_value})
+                return
+            except Exception as e:
+                # the entry runs again next time, its dependents need
+                # the return value
+                lg.debug('return value of %s not cached: %s', entry._entry_name, e)
+        self.cache.set(key, {})
+
+    def reload(self, paths, filepaths):
+        """Returns a new suite of `filepaths`, the modules in `paths` are
+        loaded again and the runners of other modules are reused
+        """
+        suite = SuiteRunner(self.runner_class)
+        suite.reporters = self.reporters
+        for runner in self.runners:
+            if os.path.abspath(runner.module_path) in paths:
+                # load from scratch, so that removed entries are gone
+                sys.modules.pop(runner.module.__name__, None)
+                suite.get_runner(runner.module_path)
+            else:
+                runner.suite = suite
+                suite.add_runner(runner)
+        for filepath in filepaths:
+            suite.add_path(filepath)
+        suite.prepare()
+        return suite
+
+    def reuse_states(self, suite, hashes, dirty):
+        """Take the states of the entries that did not change from `suite`,
+        an entry did not change if it's the same function, or if it has
+        the same name and source as before, unless its module is in
+        `dirty`. Returns the entries to run that got no state
+        """
+        entries_by_name = {}
+        for entry in suite.states:
+            entries_by_name[full_name(entry)] = entry
+        # sources are read through linecache, which may be outdated
+        linecache.checkcache()
+
+        self.states = StateTable(self.graph)
+        self.returns = self.new_return_store(self.entries_to_run)
+        modified = []
+        for entry in self.entries_to_run:
+            name = full_name(entry)
+            if entry in suite.states:
+                old_entry = entry
+            elif (name in entries_by_name and entry._module_runner.module.__name__ not in dirty and
+                    hashes.get(name) == hash_source(entry)):
+                old_entry = entries_by_name[name]
+            else:
+                modified.append(entry)
+                continue
+            self.states[entry] = suite.states[old_entry]
+            self.states.finish(entry)
+            self.returns.take(entry, suite.returns, old_entry)
+        return modified
+
+    def rerun(self, entries):
+        """Run `entries` again and keep the states of the other entries,
+        dependencies that have no state are run too
+        """
+        entries = set(entries)
+        entries |= set(i for i in self.graph.closure_of(entries) if not self.states.is_finished(i))
+        lg.debug('rerun entries: %s', [i._entry_name for i in entries])
+        for entry in entries:
+            self.states[entry] = EntryState()
+        for entry in entries:
+            for dep in self.graph.closure(entry):
+                if dep not in entries and self.states[dep].status != OK:
+                    self.states[entry].status = UNMET
+                    break
+        if config.incremental:
+            self.cache_keys = self.get_cache_keys()
+        self.fixtures = FixtureManager(entries)
+        self.start_watchdog(entries)
+        self.failures = 0
+        try:
+            self._dispatch(self.graph.sorted(entries))
+        finally:
+            self.fixtures.teardown_all()
+            self.watchdog.stop()
+        self.not_run = [i for i in self.graph.sorted(entries) if not self.states.is_finished(i)]
+
+    def spread_unmet(self, entry, entries, states):
+        """Mark everything that depends on `entry` as UNMET in one step"""
+        for dependent in self.graph.reverse_closure(entry) & entries:
+            state = states[dependent]
+            state.status = UNMET
+            # a cached result does not stand when a dependency fails
+            state.cached = False
+            state.return_value = None
 
     def run_entry(self, entry, states):
         lg.debug('run entry %s', entry)
         state = states[entry]
-        entry_runner = EntryRunner(entry, state, self)
+        entry_runner = EntryRunner(entry, state, entry._module_runner)
         entry_runner.run()
 
-    def __str__(self):
-        return '<ModuleRunner: {}>'.format(self.module.__name__)
+
+# the SuiteRunner which worker processes run components for
+_process_suite = None
+
+# seconds worker processes get to stop after --global-timeout
+_cancel_grace = 5
+
+
+def _run_component(indices):
+    """Run in a worker process, returns the output and the states of
+    the component
+    """
+    suite = _process_suite
+    entries = [suite.graph.entries[i] for i in indices]
+    # results are reported by the parent process
+    suite.reporters = []
+    suite.in_worker = True
+
+    stdout = sys.stdout
+    sys.stdout = output = StringIO()
+    try:
+        suite._dispatch(entries)
+    finally:
+        # fixtures of the worker end with each component
+        suite.fixtures.teardown_all()
+        sys.stdout = stdout
+
+    # return values are left in the store of the worker, entries not run
+    # after --maxfail are left out
+    states = [(suite.graph.index[i], suite.states[i]) for i in entries if suite.states.is_finished(i)]
+    return output.getvalue(), states
 
 
 class EntryRunner(object):
@@ -158,9 +771,13 @@ class EntryRunner(object):
             self.is_generator_function = False
         self.state = state
         self.module_runner = module_runner
+        self.suite = module_runner.suite
+        self.print_lock = self.suite.print_lock
         self.stdout = []
         self._buf = None
         self.output = None
+        # fixtures of the entry scope
+        self.scope = None
 
         # config
         self.clear = False
@@ -169,58 +786,178 @@ class EntryRunner(object):
         entry = self.entry
         state = self.state
 
-        if state['unmet']:
+        if not state.cached and self.suite.expired():
+            lg.debug('%s not run, --global-timeout reached', entry._entry_name)
+            state.status = UNMET
+
+        if state.status == UNMET:
             lg.debug('%s UNMET, skip run', entry._entry_name)
-            self.log_state_start()
-            self.log_state_end()
+            self._log_start()
+            self._log_end()
             return
 
-        self.log_state_start()
+        if state.cached:
+            lg.debug('%s cached, skip run', entry._entry_name)
+            self._log_start()
+            self._log_end()
+            return
 
-        self.before()
+        self._log_start()
+
+        timings = {'capture': 0, 'setup': 0, 'call': 0, 'teardown': 0}
+        start, cpu_start = wall_time(), cpu_time()
+
+        with timed(timings, 'capture'):
+            self.before()
 
+        watched = self.watch(start)
         try:
-            args = []
-            for i in entry.dependencies:
-                dep = self.module_runner.entries_dict[i['name']]
-                dep_state = self.module_runner.states[dep]
-                with_return = i['with_return']
-                if with_return:
-                    args.append(dep_state['return_value'])
-                #lg.info('dep %s %s', dep, dep_state)
-            if self.is_generator_function:
-                print
-                self.call_generator_entry(entry, args)
-            else:
-                state['return_value'] = entry(*args)
+            with self.suite.watchdog.calling():
+                with timed(timings, 'setup'):
+                    kwargs = self.setup()
+                args = []
+                # dependencies from module_depend_on come after the ones of
+                # `entry.dependencies` and are left out by zip
+                for dep, i in zip(self.suite.graph.dependencies[entry], entry.dependencies):
+                    with_return = i['with_return']
+                    if with_return:
+                        args.append(self.suite.returns.get(dep))
+                    #lg.info('dep %s %s', dep, dep_state)
+                with timed(timings, 'call'):
+                    if self.is_generator_function:
+                        self.call_generator_entry(entry, args, kwargs)
+                    else:
+                        state.return_value = entry(*args, **kwargs)
         except SubEntriesFailed:
-            state['ok'] = False
+            state.status = FAILED
         except:
-            state['traceback'] = traceback.format_exc()
-            state['ok'] = False
+            state.traceback = traceback.format_exc()
+            state.status = FAILED
         else:
-            state['ok'] = True
+            state.status = OK
         finally:
-            state['executed'] = True
-
-        self.after()
+            state.executed = True
+            if watched:
+                try:
+                    reason = self.suite.watchdog.unwatch()
+                except EntryTimeout as e:
+                    # an alarm that came after the entry returned
+                    reason = str(e)
+                    self.suite.watchdog.unwatch()
+                if reason is not None:
+                    state.status = FAILED
+                    # the entry may have caught the exception
+                    if reason not in (state.traceback or ''):
+                        state.traceback = (state.traceback or '') + reason + '\n'
+
+        with timed(timings, 'teardown'):
+            errors = self.teardown()
+        if errors:
+            state.status = FAILED
+            state.traceback = ''.join(filter(None, [state.traceback] + errors))
+
+        with timed(timings, 'capture'):
+            self.after()
+
+        state.timings = timings
+        state.duration = wall_time() - start
+        # CPU time is counted for the whole process, it only belongs to
+        # the entry when no other entries run at the same time
+        if config.workers <= 1:
+            state.cpu_time = cpu_time() - cpu_start
+
+        self._log_end()
+
+    def watch(self, start):
+        """Let the watchdog interrupt the entry when it runs past its
+        timeout or --global-timeout, returns whether it's watched
+        """
+        entry = self.entry
+        limits = []
+        seconds = getattr(entry, 'timeout', None) or config.timeout
+        if seconds:
+            limits.append((start + seconds, 'after {}s'.format(seconds)))
+        if self.suite.deadline is not None:
+            limits.append((self.suite.deadline, 'by --global-timeout'))
+        if not limits:
+            return False
+        deadline, description = min(limits)
+        on_abandon = None
+        if self.suite._finished is not None:
+            on_abandon = functools.partial(self.suite.abandon, entry)
+        self.suite.watchdog.watch(deadline, '{} timed out {}'.format(full_name(entry), description), on_abandon)
+        return True
+
+    def setup(self):
+        """Set up fixtures and run the setup of `with_setup`, returns the
+        fixtures the entry uses by name
+        """
+        self.scope = FixtureScope(full_name(self.entry))
+        kwargs = self.suite.fixtures.setup(self.entry, self.scope)
+        run_with_setup(self.entry, self.scope)
+        return kwargs
+
+    def teardown(self):
+        """Tear down what `setup` did, returns formatted errors"""
+        if self.scope is None:
+            return []
+        return self.scope.teardown()
+
+    def _log_start(self):
+        if self.print_lock is None:
+            self.log_state_start()
 
-        self.log_state_end()
+    def _log_end(self):
+        if self.print_lock is None:
+            self.log_state_end()
+            return
+        with self.print_lock:
+            self.log_state_start()
+            self.log_state_end()
 
-    def call_generator_entry(self, entry, args):
-        sers = []
-        for x in entry(*args):
-            func = x[0]
-            func_args = x[1:]
-            func._entry_name = entry._entry_name
-            ser = SubEntryRunner(func, new_state(), self.module_runner, self, func_args)
+    def call_generator_entry(self, entry, args, kwargs):
+        """Run the cases yielded by a generator entry as they come, only
+        the reports of failing cases are kept, and become the traceback of
+        the entry
+        """
+        counts = {'total': 0, 'failed': 0}
+        failures = []
+        lock = threading.Lock()
+
+        def run(index, func, func_args):
+            ser = SubEntryRunner(func, EntryState(), self.module_runner, self, func_args)
             ser.run()
-            sers.append(ser)
-        if filter(lambda x: x.state['ok'] is False, sers):
+            with lock:
+                counts['total'] += 1
+                if not ser.state.ok:
+                    counts['failed'] += 1
+                    failures.append((index, ser.report()))
+
+        cases = ((i, x[0], x[1:]) for i, x in enumerate(entry(*args, **kwargs)))
+        if config.sub_workers > 1:
+            stdout = sys.stdout
+            if not isinstance(stdout, ThreadLocalStdout):
+                sys.stdout = ThreadLocalStdout(stdout)
+            try:
+                with threaded_logging():
+                    run_in_pool(run, cases, config.sub_workers)
+            finally:
+                sys.stdout = stdout
+        else:
+            for case in cases:
+                run(*case)
+
+        lg.debug('%s: %s cases, %s failed', entry._entry_name, counts['total'], counts['failed'])
+        if counts['failed']:
+            failures.sort()
+            self.state.traceback = '{} of {} cases failed:\n\n{}'.format(
+                counts['failed'], counts['total'], '\n'.join(i for _, i in failures))
             raise SubEntriesFailed()
 
     def before(self):
-        if not config.nocapture:
+        if config.capture == 'fd':
+            self.capture_fd()
+        elif not config.nocapture:
             # capture_stdout
             self.capture_stdout()
 
@@ -231,23 +968,25 @@ class EntryRunner(object):
     def after(self):
         state = self.state
 
-        if not config.nocapture:
+        if config.capture == 'fd':
+            self.restore_fd()
+            state.captured_stdout = self._get_buffer()
+        elif not config.nocapture:
             # get output
-            state['captured_stdout'] = self._get_buffer()
+            state.captured_stdout = self._get_buffer()
 
             # restore_stdout
             self.restore_stdout()
 
         if not config.nologcapture:
             # get logging
-            state['captured_logging'] = self._get_logging()
+            state.captured_logging = self._get_logging()
 
             # restore_logging
             self.restore_logging()
 
     def capture_stdout(self):
-        self.stdout.append(sys.stdout)
-        self._buf = StringIO()
+        self._buf = CaptureBuffer(config.capture_memory)
         # Python 3's StringIO objects don't support setting encoding or errors
         # directly and they're already set to None.  So if the attributes
         # already exist, skip adding them.
@@ -257,28 +996,62 @@ class EntryRunner(object):
         if (not hasattr(self._buf, 'errors') and
                 hasattr(sys.stdout, 'errors')):
             self._buf.errors = sys.stdout.errors
+        if isinstance(sys.stdout, ThreadLocalStdout):
+            # only replace stdout of the current thread
+            sys.stdout.push(self._buf)
+            self.stdout.append(None)
+            return
+        self.stdout.append(sys.stdout)
         sys.stdout = self._buf
 
     def restore_stdout(self):
         while self.stdout:
-            sys.stdout = self.stdout.pop()
+            stdout = self.stdout.pop()
+            if stdout is None:
+                # an abandoned entry may find stdout already restored
+                if isinstance(sys.stdout, ThreadLocalStdout):
+                    sys.stdout.pop()
+            else:
+                sys.stdout = stdout
         lg.debug('stdout restored %s', sys.stdout)
 
+    def capture_fd(self):
+        self._buf = FDCapture()
+        self._buf.start()
+        self.stdout.append(sys.stdout)
+        sys.stdout = self._buf.stdout
+
+    def restore_fd(self):
+        self.restore_stdout()
+        self._buf.stop()
+
     def capture_logging(self):
         lg.debug('call setup_log_handler in EntryRunner')
-        setup_log_handler(config.log_handler)
+        setup_log_handler(config.log_handler, level=config.log_level)
 
     def restore_logging(self):
         pass
 
     def _get_buffer(self):
-        if self._buf is not None:
-            return self._buf.getvalue()
+        if self._buf is None:
+            return None
+        try:
+            # output of passing entries is never printed
+            if self.state.ok and not self.suite.keep_output:
+                return None
+            return self._buf.getvalue(config.output_head, config.output_tail)
+        finally:
+            self._buf.close()
+            self._buf = None
 
     def _get_logging(self):
-        l = map(safe_str, config.log_handler.buffer)
-        config.log_handler.truncate()
-        return l
+        try:
+            # logging of passing entries is never printed
+            if self.state.ok and not self.suite.keep_output:
+                return None
+            return map(safe_str, config.log_handler.formatted())
+        finally:
+            config.log_handler.truncate()
 
     # _prompt_symbol = '➔'
     # _prompt_symbol = '➤'
@@ -296,20 +1069,23 @@ class EntryRunner(object):
 
     def log_state_end(self):
         state = self.state
-        status = get_state_status(state)
-        print color.dye(STATUS_COLORS[status], status)
-        if status == 'FAILED' and not self.is_generator_function:
+        status = state.status_name
+        if state.cached:
+            print color.dye(STATUS_COLORS[status], status), '(cached)'
+        else:
+            print color.dye(STATUS_COLORS[status], status)
+        if status == 'FAILED':
             # print hr('=')
             # print hr('-')
             print hr('=')
-            print state['traceback']
-            if not config.nocapture and state['captured_stdout']:
+            print state.traceback
+            if not config.nocapture and state.captured_stdout:
                 print ln('>> begin captured stdout <<')
-                print state['captured_stdout']
+                print state.captured_stdout
                 print ln('>> end captured stdout <<')
-            if not config.nologcapture and state['captured_logging']:
+            if not config.nologcapture and state.captured_logging:
                 print ln('>> begin captured logging <<')
-                print '\n'.join(state['captured_logging'])
+                print '\n'.join(state.captured_logging)
                 print ln('>> end captured logging <<')
             print hr('-')
             print ''
@@ -317,12 +1093,26 @@ class EntryRunner(object):
             pass
 
 
+def run_with_setup(func, scope):
+    """Run the setup added by `with_setup`, its teardown is left to the
+    end of `scope` and only runs if the setup passed
+    """
+    setup = getattr(func, 'setup', None)
+    if setup is not None:
+        setup()
+    teardown = getattr(func, 'teardown', None)
+    if teardown is not None:
+        scope.add_finalizer(teardown)
+
+
 class SubEntriesFailed(Exception):
     """indicate sub entries failed"""
 
 
 class SubEntryRunner(EntryRunner):
-    indent = '  '
+    """Runs a case yielded by a generator entry, nothing is printed, the
+    generator entry reports failing cases
+    """
 
     def __init__(self, entry, state, module_runner, entry_runner, args):
         super(SubEntryRunner, self).__init__(entry, state, module_runner)
@@ -334,119 +1124,254 @@ class SubEntryRunner(EntryRunner):
         state = self.state
         args = self.args
 
-        self.log_state_start()
         self.before()
 
+        scope = FixtureScope(entry.__name__)
         try:
+            run_with_setup(entry, scope)
             entry(*args)
         except:
-            state['traceback'] = traceback.format_exc()
-            state['ok'] = False
+            state.traceback = traceback.format_exc()
+            state.status = FAILED
         else:
-            state['ok'] = True
+            state.status = OK
         finally:
-            state['executed'] = True
+            state.executed = True
+        errors = scope.teardown()
+        if errors:
+            state.status = FAILED
+            state.traceback = ''.join(filter(None, [state.traceback] + errors))
 
         self.after()
-        self.log_state_end()
 
-    def log_state_start(self):
-        print '{}{}({})'.format(
-            self.indent,
-            color.dye('blue', '- {}'.format(self.entry._entry_name)),
-            ','.join(repr(i) for i in self.args),
-        ),
-
-
-def log_summary(runners):
-    summary = {'UNMET': 0, 'OK': 0, 'FAILED': 0, 'total': 0}
-    for runner in runners:
-        lg.debug('runner %s', runner)
-        if not runner.entries:
-            continue
-        for entry, state in runner.states.iteritems():
-            status = get_state_status(state)
-            summary[status] += 1
-            summary['total'] += 1
+    def report(self):
+        state = self.state
+        lines = [
+            '- {}({})'.format(self.entry.__name__, ', '.join(repr(i) for i in self.args)),
+            state.traceback.rstrip(),
+        ]
+        if state.captured_stdout:
+            lines.extend([ln('>> begin captured stdout <<'), state.captured_stdout.rstrip(),
+                          ln('>> end captured stdout <<')])
+        if state.captured_logging:
+            lines.extend([ln('>> begin captured logging <<')] + state.captured_logging +
+                         [ln('>> end captured logging <<')])
+        return '\n'.join(lines) + '\n'
+
+
+def print_graph(suite, fmt):
+    """Print entries to run and their dependencies, in the order they
+    would run
+    """
+    def name(entry):
+        return '{}.{}'.format(entry._module_runner.module.__name__, entry._entry_name)
 
-    colored_statuses = {i: (i if summary[i] == 0 else COLORED_STATUSES[i]) for i in STATUS_NAMES}
+    entries = list(Scheduler(suite.graph, suite.entries_to_run, suite.priorities))
 
-    print hr('_')
-    print 'Ran {s.total} tests, {c.OK} {s.OK}, {c.FAILED} {s.FAILED}, {c.UNMET} {s.UNMET}'.format(
-        s=ObjectDict(summary),
-        c=ObjectDict(colored_statuses))
+    if fmt == 'json':
+        data = []
+        for entry in entries:
+            data.append({
+                'name': full_name(entry),
+                'path': entry._module_runner.module_path,
+                'dependencies': [full_name(i) for i in suite.graph.dependencies[entry]],
+            })
+        print json.dumps({'entries': data}, indent=2)
+    elif fmt == 'dot':
+        print 'digraph deptest {'
+        for entry in entries:
+            print '    "{}";'.format(name(entry))
+            for dep in suite.graph.dependencies[entry]:
+                print '    "{}" -> "{}";'.format(name(dep), name(entry))
+        print '}'
+    else:
+        for entry in entries:
+            deps = suite.graph.dependencies[entry]
+            if deps:
+                print '{} <- {}'.format(name(entry), ', '.join(name(i) for i in deps))
+            else:
+                print name(entry)
 
 
-def new_state():
-    return {
-        'unmet': False,
-        'executed': False,
-        'ok': False,
-        'return_value': None,
-        'traceback': None,
-        'captured_stdout': None,
-        'captured_logging': None,
-    }
+def log_durations(suite, n):
+    executed = [i for i in suite.states if suite.states[i].duration is not None]
+    if not executed:
+        return
 
+    def name(entry):
+        return '{}.{}'.format(entry._module_runner.module.__name__, entry._entry_name)
 
-def get_state_status(state):
-    if state['unmet']:
-        status = 'UNMET'
-    elif state['ok']:
-        status = 'OK'
-    else:
-        status = 'FAILED'
-    return status
+    print hr('_')
+    print 'Slowest {} entries:'.format(min(n, len(executed)))
+    executed.sort(key=lambda i: suite.states[i].duration, reverse=True)
+    for entry in executed[:n]:
+        state = suite.states[entry]
+        line = '{:>9.3f}s  {}  (setup {t[setup]:.3f}s, call {t[call]:.3f}s, teardown {t[teardown]:.3f}s, ' \
+            'capture {t[capture]:.3f}s'.format(state.duration, name(entry), t=state.timings)
+        if state.cpu_time is not None:
+            line += ', cpu {:.3f}s'.format(state.cpu_time)
+        print line + ')'
+
+    durations = {i: suite.states[i].duration or 0 for i in suite.states}
+    # entries not run after --maxfail have no duration
+    finished = [i for i in suite.entries_to_run if suite.states.is_finished(i)]
+    total, path = suite.graph.critical_path(finished, durations)
+    print ''
+    print 'Critical path ({:.3f}s):'.format(total)
+    for entry in path:
+        print '{:>9.3f}s  {}'.format(durations[entry], name(entry))
+
+    # return values of worker processes stay in the workers
+    if config.processes <= 1:
+        returns = suite.returns
+        print ''
+        print 'Return values: peak {:.1f} KB in memory, {} spilled to disk'.format(
+            returns.peak / 1024.0, returns.spilled_count)
+
+
+def log_summary(suite):
+    # counted as entries finish
+    states = suite.states
+    summary = dict(zip(STATUS_NAMES, states.counts))
+    summary['total'] = sum(states.counts)
+    summary['cached'] = states.cached
 
+    colored_statuses = {i: (i if summary[i] == 0 else COLORED_STATUSES[i]) for i in STATUS_NAMES}
 
-def set_state(state, key, value):
-    state[key] = value
+    line = 'Ran {s.total} tests, {c.OK} {s.OK}, {c.FAILED} {s.FAILED}, {c.UNMET} {s.UNMET}'.format(
+        s=ObjectDict(summary),
+        c=ObjectDict(colored_statuses))
+    if config.incremental:
+        line += ', {} cached'.format(summary['cached'])
+    if suite.not_run:
+        line += ', {} not run'.format(len(suite.not_run))
+
+    print hr('_')
+    # entries are also left not run by --global-timeout
+    if config.maxfail and suite.max_failed():
+        print 'Stopped, --maxfail {} reached'.format(config.maxfail)
+    print line
 
 
-def is_failed(state):
-    return state['executed'] and not state['ok']
+def watch(suite, filepaths):
+    """Run again each time a test module, or a module imported from the
+    current directory changes. Only the entries that changed and their
+    dependents are run, the states of the other entries, including their
+    return values, are kept in memory
+    """
+    # reporters are finished after the first run
+    suite.reporters = []
+    watcher = FileWatcher()
+    # changed paths that failed to load are tried again with the next change
+    pending = set()
+    print ''
+    print 'Watching for changes, press Ctrl-C to stop'
+    try:
+        while True:
+            # sources have to be hashed before they change
+            hashes = {}
+            for entry in suite.states:
+                hashes[full_name(entry)] = hash_source(entry)
+            helpers = watched_modules(suite)
+            for path in helpers:
+                watcher.add(path)
+            for runner in suite.runners:
+                watcher.add(runner.module_path)
+
+            changed = []
+            while not changed:
+                time.sleep(config.watch_interval)
+                changed = watcher.changed()
+            pending.update(changed)
+            lg.debug('changed: %s', sorted(pending))
+
+            try:
+                new_suite, dirty = reload_changed(suite, pending, helpers, filepaths)
+            except Exception:
+                traceback.print_exc()
+                print 'Failed to load changes, waiting for more changes'
+                continue
+            pending.clear()
 
+            modified = new_suite.reuse_states(suite, hashes, dirty)
+            affected = set(modified)
+            for entry in modified:
+                affected |= new_suite.graph.reverse_closure(entry)
+            affected &= set(new_suite.entries_to_run)
+            suite = new_suite
 
-def should_unmet(deps, states):
-    unmet = False
-    # if any deps not OK or UNMET, should unmet
-    for dep in deps:
-        state = states[dep]
-        if is_failed(state) or state['unmet']:
-            unmet = True
-    return unmet
+            print hr('=')
+            if not affected:
+                print 'No entries changed'
+                continue
+            suite.rerun(affected)
+            log_summary(suite)
+            suite.save_history()
+    except KeyboardInterrupt:
+        print ''
 
 
-def should_pending(deps, states):
-    """First a entry is NOT UNMET, then consider if should pending,
-    in other words, the prerequisite of PENDING is NOT UNMET
+def reload_changed(suite, paths, helpers, filepaths):
+    """Reload changed helper modules, and returns a new suite with the
+    changed test modules loaded again. Test modules using a reloaded module
+    are loaded again too, their names are returned as dirty
     """
-    pending = False
-    # if any deps not executed, should pending
-    for dep in deps:
-        state = states[dep]
-        if not state['executed']:
-            pending = True
-    return pending
-
-
-def traverse_entry_dependencies(entry, entries_dict, childs=None):
-    if childs is None:
-        childs = [entry]
-    else:
-        if entry not in childs:
-            childs.append(entry)
+    names = set()
+    for path in sorted(paths):
+        if path in helpers:
+            lg.info('reload %s', helpers[path].__name__)
+            reload(helpers[path])
+            names.add(helpers[path].__name__)
+
+    paths = set(i for i in paths if i not in helpers)
+    for runner in suite.runners:
+        if os.path.abspath(runner.module_path) in paths:
+            names.add(runner.module.__name__)
+    dirty = set()
+    found = True
+    while found:
+        found = False
+        for runner in suite.runners:
+            path = os.path.abspath(runner.module_path)
+            if path not in paths and uses_modules(runner.module, names):
+                paths.add(path)
+                names.add(runner.module.__name__)
+                dirty.add(runner.module.__name__)
+                found = True
+
+    return suite.reload(paths, filepaths), dirty
+
+
+def watched_modules(suite):
+    """Modules loaded from the current directory other than test modules,
+    by the paths of their sources
+    """
+    cwd = os.getcwd() + os.sep
+    own = os.path.dirname(os.path.abspath(__file__)) + os.sep
+    test_paths = set(os.path.abspath(i.module_path) for i in suite.runners)
+    modules = {}
+    for module in sys.modules.values():
+        path = module_source(module)
+        if (path and path.startswith(cwd) and not path.startswith(own) and
+                'site-packages' not in path and path not in test_paths):
+            modules[path] = module
+    return modules
+
+
+def uses_modules(module, names):
+    """Whether `module` holds modules in `names`, or objects from them"""
+    for value in vars(module).values():
+        if inspect.ismodule(value):
+            name = value.__name__
+        else:
+            name = getattr(value, '__module__', None)
+        if name in names:
+            return True
+    return False
+
 
-    deps = []
-    for i in entry.dependencies:
-        dep = entries_dict[i['name']]
-        #print 'entry', entry, 'dep', dep, 'childs', childs
-        if dep in childs:
-            raise ValueError(
-                'recursive dependency detected: {} depend on {}'.format(entry._entry_name, dep._entry_name))
-        deps.append(dep)
-        merge_list(deps, traverse_entry_dependencies(dep, entries_dict, list(childs)))
-    return deps
+def full_name(entry):
+    return '{}:{}'.format(entry._module_runner.module.__name__, entry._entry_name)
 
 
 def depend_on(dep_name, with_return=False):
@@ -470,8 +1395,35 @@ def depend_on(dep_name, with_return=False):
     return decorator_func
 
 
-def module_depend_on(dep_names):
+def uses(resource, mode='write'):
+    """Declare that the entry uses `resource`, like a database table or a
+    mock server. Entries writing a resource never run at the same time as
+    other entries using it, entries only reading it may run together.
     """
+    if mode not in ('read', 'write'):
+        raise ValueError('mode should be read or write')
+
+    def decorator_func(f):
+        if not hasattr(f, 'resources'):
+            f.resources = []
+        if resource in [i['name'] for i in f.resources]:
+            raise ValueError('Use one resource twice is not allowed')
+        f.resources.append(
+            {
+                'name': resource,
+                'mode': mode
+            }
+        )
+        return f
+
+    return decorator_func
+
+
+def module_depend_on(dep_names):
+    """Make every entry of the calling module depend on all the entries
+    of modules `dep_names`, which are looked up in the same directory if
+    not given in command line.
+
     module_a.py:
 
         foo = 0
@@ -487,29 +1439,102 @@ def module_depend_on(dep_names):
         def test_bar():
             pass
     """
+    module_globals = sys._getframe(1).f_globals
+    module_dependencies = module_globals.setdefault(MODULE_DEPENDENCIES_ATTR, [])
+    for name in dep_names:
+        if name == module_globals.get('__name__'):
+            raise ValueError('Depend on self is not allowed')
+        if name not in module_dependencies:
+            module_dependencies.append(name)
 
 
-def with_setup(setup_func=None, teardown_func=None):
-    pass
+_ignore_patterns = ['.git']
 
 
-_ignore_dirs = ['.git']
+_test_file_pattern = re.compile(r'^(.+_test|test_.+)\.py$')
 
 
-_test_file_pattern = re.compile(r'^(.+_test|test_.+)\.py$')
+def scan_dir(dirpath, ignore_patterns):
+    """Returns test files and sub directories in `dirpath`, both sorted"""
+    files, dirs = [], []
+    if scandir is not None:
+        items = [(i.name, i.is_dir(follow_symlinks=False)) for i in scandir(dirpath)]
+    else:
+        items = []
+        for name in os.listdir(dirpath):
+            path = os.path.join(dirpath, name)
+            items.append((name, os.path.isdir(path) and not os.path.islink(path)))
+
+    for name, is_dir in sorted(items):
+        path = os.path.join(dirpath, name)
+        if any(fnmatch.fnmatch(name, i) or fnmatch.fnmatch(path, i) for i in ignore_patterns):
+            lg.debug('ignore %s at %s', name, dirpath)
+            continue
+        if is_dir:
+            dirs.append(path)
+        elif _test_file_pattern.match(name):
+            files.append(path)
+    return files, dirs
+
 
+def run_in_pool(func, items, workers):
+    """Call `func` with each tuple of `items` in a thread pool. Items are
+    taken lazily, at most twice as many as `workers` are waiting
+    """
+    slots = threading.BoundedSemaphore(workers * 2)
+
+    def call(item):
+        try:
+            func(*item)
+        finally:
+            slots.release()
+
+    pool = ThreadPool(workers)
+    try:
+        for item in items:
+            slots.acquire()
+            pool.apply_async(call, (item, ))
+    finally:
+        pool.close()
+        pool.join()
+
+
+@contextlib.contextmanager
+def threaded_logging():
+    """Capture logging of each thread separately in the block"""
+    if config.log_handler is None:
+        yield
+        return
+    with config.log_handler.threaded():
+        yield
 
-def walk_dir(dirpath, filepaths):
-    for root, dirs, files in os.walk(dirpath):
-        for name in files:
-            if _test_file_pattern.match(name):
-                filepath = os.path.join(root, name)
-                filepaths.append(filepath)
 
-        for dir in dirs:
-            if dir in _ignore_dirs:
-                lg.debug('ignore %s at %s', dir, root)
-                dirs.remove(dir)
+def walk_dir(dirpath, filepaths, ignore_patterns=None, threads=8):
+    """Scan directories level by level in a thread pool, test files are
+    collected in the same order as a top-down walk
+    """
+    if ignore_patterns is None:
+        ignore_patterns = _ignore_patterns
+    scanned = {}
+    level = [dirpath]
+    pool = ThreadPool(threads)
+    try:
+        while level:
+            results = pool.map(lambda i: scan_dir(i, ignore_patterns), level)
+            next_level = []
+            for path, result in zip(level, results):
+                scanned[path] = result
+                next_level.extend(result[1])
+            level = next_level
+    finally:
+        pool.close()
+        pool.join()
+
+    stack = [dirpath]
+    while stack:
+        files, dirs = scanned[stack.pop()]
+        filepaths.extend(files)
+        stack.extend(reversed(dirs))
 
 
 def define_config(parser):
@@ -518,12 +1543,140 @@ def define_config(parser):
     config.define('nocapture', 'args')
     parser.add_argument('-s', '--nocapture', action='store_true', help="Don't capture stdout (any stdout output will be printed immediately)")
 
+    config.define('capture', 'args')
+    parser.add_argument('--capture', choices=['sys', 'fd', 'no'], default='sys',
+                        help="How to capture stdout: replace sys.stdout (default), redirect "
+                        "file descriptors 1 and 2 to catch output of subprocesses, or not at all (same as -s)")
+
     config.define('nologcapture', 'args')
     parser.add_argument('--nologcapture', action='store_true', help="Don't capture logging")
 
+    config.define('capture_memory', 'args')
+    parser.add_argument('--capture-memory', metavar='BYTES', type=int, default=1024 * 1024,
+                        help="Keep at most BYTES of captured stdout of an entry in memory, "
+                        "spill the rest to a temporary file (default: 1MB)")
+
+    config.define('output_head', 'args')
+    parser.add_argument('--output-head', metavar='N', type=int, default=0,
+                        help="Only keep the first N lines of captured stdout")
+
+    config.define('output_tail', 'args')
+    parser.add_argument('--output-tail', metavar='N', type=int, default=0,
+                        help="Only keep the last N lines of captured stdout")
+
+    config.define('log_level', 'args')
+    parser.add_argument('--log-level', choices=['NOTSET', 'DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                        default='NOTSET', help="Capture only logging of this level and above, "
+                        "records below are not created at all (default: NOTSET)")
+
+    config.define('log_capacity', 'args')
+    parser.add_argument('--log-capacity', metavar='N', type=int, default=10000,
+                        help="Keep at most the last N captured logging records of an entry (default: 10000)")
+
+    config.define('logging_filter', 'args')
+    parser.add_argument('--logging-filter', metavar='FILTER',
+                        help="Only capture logging of these comma separated logger names and their "
+                        "children, names prefixed with a minus are excluded, e.g. foo,-foo.bar")
+
+    config.define('ignore', 'args')
+    parser.add_argument('--ignore', metavar='GLOB', action='append',
+                        help="Ignore files and dirs matching GLOB when scanning dirs, "
+                        "can be given multiple times ('.git' is always ignored)")
+
+    config.define('prescan', 'args')
+    parser.add_argument('--prescan', action='store_true',
+                        help="Parse scanned files first, skip those that define no test functions")
+
     config.define('dry', 'args')
     parser.add_argument('--dry', action='store_true', help="Dry run, only show matched files")
 
+    config.define('collect_only', 'args')
+    parser.add_argument('--collect-only', action='store_true',
+                        help="Only show the entries to run and their dependencies, "
+                        "modules are parsed instead of imported when possible")
+
+    config.define('graph_format', 'args')
+    parser.add_argument('--graph-format', choices=['text', 'dot', 'json'], default='text',
+                        help="Output format of --collect-only (default: text)")
+
+    config.define('workers', 'args')
+    parser.add_argument('--workers', metavar='N', type=int, default=1, help="Run independent entries in N threads")
+
+    config.define('timeout', 'args')
+    parser.add_argument('--timeout', metavar='SECONDS', type=float,
+                        help="Fail entries running longer than SECONDS, unless set by @timeout, "
+                        "stacks of all threads are logged when an entry times out")
+
+    config.define('global_timeout', 'args')
+    parser.add_argument('--global-timeout', metavar='SECONDS', type=float,
+                        help="Stop after SECONDS, running entries fail and the ones not run yet are UNMET")
+
+    config.define('sub_workers', 'args')
+    parser.add_argument('--sub-workers', metavar='N', type=int, default=1,
+                        help="Run the cases yielded by a generator entry in N threads")
+
+    config.define('maxfail', 'args')
+    parser.add_argument('-x', '--exitfirst', dest='maxfail', action='store_const', const=1, default=0,
+                        help="Stop after the first failure, same as --maxfail 1")
+    parser.add_argument('--maxfail', metavar='N', type=int, default=0,
+                        help="Stop starting entries after N failures, running ones are finished")
+
+    config.define('time_budget', 'args')
+    parser.add_argument('--time-budget', metavar='SECONDS', type=float,
+                        help="Only run the entries that fit in SECONDS by their durations in history, "
+                        "preferring the ones that did not pass last time, together with their dependencies")
+
+    config.define('processes', 'args')
+    parser.add_argument('--processes', metavar='N', type=int, default=1,
+                        help="Run connected components of the dependency graph in N processes")
+
+    config.define('spill_returns', 'args')
+    parser.add_argument('--spill-returns', metavar='BYTES', type=int,
+                        help="Pickle return values bigger than BYTES to temporary files instead of "
+                        "keeping them in memory until the dependents taking them have run")
+
+    config.define('incremental', 'args')
+    parser.add_argument('--incremental', action='store_true',
+                        help="Skip entries that passed last time and have not changed since")
+
+    config.define('last_failed', 'args')
+    parser.add_argument('--lf', '--last-failed', dest='last_failed', action='store_true',
+                        help="Only run entries that did not pass last time, and their dependencies")
+
+    config.define('failed_first', 'args')
+    parser.add_argument('--ff', '--failed-first', dest='failed_first', action='store_true',
+                        help="Run entries that did not pass last time first")
+
+    config.define('durations', 'args')
+    parser.add_argument('--durations', metavar='N', type=int, default=0,
+                        help="Show N slowest entries and the critical path of the dependency graph, "
+                        "CPU time of the process spent in each entry is not shown with --workers")
+
+    config.define('jsonl', 'args')
+    parser.add_argument('--jsonl', metavar='PATH',
+                        help="Write the result of each entry as a line of JSON to PATH as soon as it finishes")
+
+    config.define('junit_xml', 'args')
+    parser.add_argument('--junit-xml', metavar='PATH', help="Write results in JUnit XML format to PATH")
+
+    config.define('shard_index', 'args')
+    parser.add_argument('--shard-index', metavar='I', type=int, default=0,
+                        help="Only run shard I of the entries, counting from 0")
+
+    config.define('shard_count', 'args')
+    parser.add_argument('--shard-count', metavar='N', type=int, default=1,
+                        help="Split the entries into N shards, balanced by the durations in history, "
+                        "all shards should share the same history to get the same split")
+
+    config.define('watch', 'args')
+    parser.add_argument('--watch', action='store_true',
+                        help="Keep running, and run changed entries and the ones depending on them "
+                        "again when test modules or modules imported from the current dir change")
+
+    config.define('watch_interval', 'args')
+    parser.add_argument('--watch-interval', metavar='SECONDS', type=float, default=1.0,
+                        help="How often to check for changes in --watch mode (default: 1)")
+
     config.define('debug', 'args')
     parser.add_argument('--debug', action='store_true', help="Set logging level to debug for deptest logger")
 
@@ -541,6 +1694,23 @@ def main():
 
     config.parse_args()
 
+    if config.nocapture:
+        config.capture = 'no'
+    elif config.capture == 'no':
+        config.nocapture = True
+    if not 0 <= config.shard_index < config.shard_count:
+        parser.error('--shard-index should be in [0, --shard-count)')
+    if config.maxfail < 0:
+        parser.error('--maxfail should not be negative')
+    if config.time_budget is not None and config.time_budget <= 0:
+        parser.error('--time-budget should be positive')
+    if config.capture == 'fd' and (config.workers > 1 or config.sub_workers > 1):
+        # file descriptors are shared by all the threads
+        parser.error('--capture=fd can not be used with --workers or --sub-workers')
+    if config.watch and (config.processes > 1 or config.shard_count > 1):
+        # states are kept in memory of this process
+        parser.error('--watch can not be used with --processes or --shard-count')
+
     if config.debug:
         logging_level = logging.DEBUG
     else:
@@ -553,16 +1723,24 @@ def main():
 
     if not config.nologcapture:
         logformat = '%(name)s: %(levelname)s: %(message)s'
-        config.log_handler = MyMemoryHandler(logformat)
+        filters = ['-deptest']
+        if config.logging_filter:
+            filters.extend(i.strip() for i in config.logging_filter.split(',') if i.strip())
+        config.log_handler = MyMemoryHandler(logformat, filters=filters, capacity=config.log_capacity)
 
         lg.debug('call setup_log_handler in global')
-        setup_log_handler(config.log_handler)
+        setup_log_handler(config.log_handler, level=config.log_level)
 
     filepaths = []
 
+    ignore_patterns = _ignore_patterns + (config.ignore or [])
     for path in config.paths:
         if os.path.isdir(path):
-            walk_dir(path, filepaths)
+            found = []
+            walk_dir(path, found, ignore_patterns)
+            if config.prescan:
+                found = [i for i in found if may_define_entries(i, ModuleRunner.entry_pattern)]
+            filepaths.extend(found)
         else:
             filepaths.append(path)
 
@@ -574,10 +1752,30 @@ def main():
     # Add cwd path to sys.path
     sys.path.insert(0, os.getcwd())
 
-    runners = []
-    for filepath in filepaths:
-        runner = ModuleRunner(filepath)
-        runners.append(runner)
-        runner.dispatch()
+    if config.collect_only:
+        suite = SuiteRunner(StaticModuleRunner)
+        for filepath in filepaths:
+            suite.add_path(filepath)
+        suite.prepare()
+        print_graph(suite, config.graph_format)
+        return
 
-    log_summary(runners)
+    suite = SuiteRunner()
+    if config.jsonl:
+        suite.reporters.append(JSONLinesReporter(config.jsonl))
+    if config.junit_xml:
+        suite.reporters.append(JUnitXMLReporter(config.junit_xml))
+    for filepath in filepaths:
+        suite.add_path(filepath)
+    suite.prepare()
+    suite.dispatch()
+    for reporter in suite.reporters:
+        reporter.finish()
+
+    if config.durations:
+        log_durations(suite, config.durations)
+    log_summary(suite)
+    suite.save_history()
+
+    if config.watch:
+        watch(suite, filepaths)
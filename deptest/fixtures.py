@@ -0,0 +1,211 @@
+# coding: utf-8
+
+"""Fixtures are set up lazily when the first entry using them runs, and
+cached for their scope:
+
+- session: until all the entries have run
+- module: until all the entries of the module have run
+- entry: until the entry has run
+
+A fixture written as a generator is torn down by resuming it after its
+`yield`. Fixtures of a scope are torn down in the reverse order they
+were set up.
+"""
+
+import inspect
+import logging
+import collections
+import threading
+import traceback
+
+lg = logging.getLogger('deptest.fixtures')
+
+SCOPES = ('session', 'module', 'entry')
+
+# set on entries by `use_fixtures`
+FIXTURES_ATTR = '_fixtures'
+
+
+class FixtureError(Exception):
+    """A fixture failed to set up before, the error is not repeated"""
+
+
+def fixture(scope='entry'):
+    """Make a function a fixture of `scope`, entries get its return value
+    (or the value it yields) with `use_fixtures`::
+
+        @fixture(scope='module')
+        def db():
+            conn = connect()
+            yield conn
+            conn.close()
+    """
+    if scope not in SCOPES:
+        raise ValueError('unknown fixture scope: {}'.format(scope))
+
+    def decorator_func(f):
+        f._fixture_scope = scope
+        return f
+
+    return decorator_func
+
+
+def use_fixtures(*names):
+    """Pass fixtures found by `names` in the module of the entry as keyword
+    arguments of the same names::
+
+        @use_fixtures('db')
+        def test_query(db):
+            pass
+    """
+    def decorator_func(f):
+        fixtures = getattr(f, FIXTURES_ATTR, [])
+        for name in names:
+            if name in fixtures:
+                raise ValueError('Use one fixture twice is not allowed')
+        setattr(f, FIXTURES_ATTR, fixtures + list(names))
+        return f
+
+    return decorator_func
+
+
+class FixtureScope(object):
+    """Values of the fixtures set up in a scope, and how to tear them down"""
+
+    def __init__(self, name):
+        self.name = name
+        # key -> (ok, value or formatted error)
+        self.values = {}
+        self.finalizers = []
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, create):
+        """Returns the value of `key`, `create` is only called by the first
+        thread asking for it, others wait for it to finish
+        """
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self.values:
+                try:
+                    self.values[key] = (True, create(self))
+                except Exception:
+                    self.values[key] = (False, traceback.format_exc())
+                    raise
+            ok, value = self.values[key]
+        if not ok:
+            raise FixtureError('{} failed to set up in {}:\n{}'.format(
+                getattr(key, '__name__', key), self.name, value))
+        return value
+
+    def add_finalizer(self, func):
+        with self._lock:
+            self.finalizers.append(func)
+
+    def teardown(self):
+        """Run finalizers in reverse order, returns formatted errors"""
+        errors = []
+        while True:
+            with self._lock:
+                if not self.finalizers:
+                    break
+                func = self.finalizers.pop()
+            try:
+                func()
+            except Exception:
+                errors.append(traceback.format_exc())
+        self.values.clear()
+        return errors
+
+
+def create_fixture(func, scope):
+    """Call fixture `func`, a generator is resumed by the finalizer"""
+    if not inspect.isgeneratorfunction(func):
+        return func()
+
+    gen = func()
+    value = next(gen)
+
+    def finalize():
+        try:
+            next(gen)
+        except StopIteration:
+            return
+        raise RuntimeError('fixture {} yields more than once'.format(func.__name__))
+
+    scope.add_finalizer(finalize)
+    return value
+
+
+def run_module_setup(runner, scope):
+    """The module scope of `runner` starts with its `global_setup`, and
+    ends with its `global_teardown`
+    """
+    if runner.module_setup is not None:
+        runner.module_setup()
+    if runner.module_teardown is not None:
+        scope.add_finalizer(runner.module_teardown)
+
+
+class FixtureManager(object):
+    """Fixtures of a run of `entries`. Module scopes end once all the
+    entries of the module are done, the session scope by `teardown_all`
+    """
+
+    def __init__(self, entries):
+        self.session = FixtureScope('session')
+        # in the order they are set up
+        self.modules = collections.OrderedDict()
+        # entries of each module not done yet
+        self.remaining = {}
+        for entry in entries:
+            runner = entry._module_runner
+            self.remaining[runner] = self.remaining.get(runner, 0) + 1
+        self._lock = threading.Lock()
+
+    def module_scope(self, runner):
+        with self._lock:
+            if runner not in self.modules:
+                self.modules[runner] = FixtureScope(runner.module.__name__)
+            return self.modules[runner]
+
+    def setup(self, entry, entry_scope):
+        """Set up the fixtures `entry` uses, returns them by name"""
+        runner = entry._module_runner
+        module_scope = self.module_scope(runner)
+        module_scope.get(run_module_setup, lambda scope: run_module_setup(runner, scope))
+
+        kwargs = {}
+        for name in getattr(entry, FIXTURES_ATTR, []):
+            func = getattr(runner.module, name, None)
+            scope_name = getattr(func, '_fixture_scope', None)
+            if scope_name is None:
+                raise ValueError('unknown fixture: {} use {}'.format(entry._entry_name, name))
+            scope = {'session': self.session, 'module': module_scope, 'entry': entry_scope}[scope_name]
+            kwargs[name] = scope.get(func, lambda scope: create_fixture(func, scope))
+        return kwargs
+
+    def entry_done(self, entry):
+        """Tear down the module scope after its last entry"""
+        runner = entry._module_runner
+        with self._lock:
+            self.remaining[runner] -= 1
+            if self.remaining[runner]:
+                return
+            scope = self.modules.pop(runner, None)
+        if scope is not None:
+            log_errors(scope)
+
+    def teardown_all(self):
+        with self._lock:
+            scopes = self.modules.values()
+            self.modules.clear()
+        for scope in reversed(scopes):
+            log_errors(scope)
+        log_errors(self.session)
+
+
+def log_errors(scope):
+    for error in scope.teardown():
+        lg.error('teardown of %s failed:\n%s', scope.name, error)
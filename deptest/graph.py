@@ -0,0 +1,168 @@
+# coding: utf-8
+
+"""Dependency graph of test entries, built once and queried by the runners
+"""
+
+import logging
+
+lg = logging.getLogger('deptest.graph')
+
+
+class DependencyGraph(object):
+    """Adjacency lists of entries and their `depend_on` dependencies,
+    `resolve` is called once for each entry and returns the entries it
+    depends on.
+
+    Cycles are detected while building, and transitive closures are
+    computed lazily and cached as frozensets, so every query after the
+    first one is a dict lookup.
+    """
+
+    def __init__(self, entries, resolve):
+        self.entries = list(entries)
+        self.index = {}
+        self.dependencies = {}
+        self.dependents = {}
+
+        for i, entry in enumerate(self.entries):
+            self.index[entry] = i
+            self.dependents[entry] = []
+
+        for entry in self.entries:
+            deps = resolve(entry)
+            for dep in deps:
+                self.dependents[dep].append(entry)
+            self.dependencies[entry] = deps
+
+        self.order = self._sort()
+
+        self._closures = {}
+        self._reverse_closures = {}
+
+    def _sort(self):
+        """Depth first search, returns entries in topological order
+        (dependencies first), raises ValueError with the full cycle path
+        if any recursive dependency is found
+        """
+        visiting, visited = set(), set()
+        order = []
+
+        for root in self.entries:
+            if root in visited:
+                continue
+            path = [root]
+            stack = [iter(self.dependencies[root])]
+            visiting.add(root)
+            while stack:
+                for dep in stack[-1]:
+                    if dep in visiting:
+                        cycle = path[path.index(dep):] + [dep]
+                        raise ValueError(
+                            'recursive dependency detected: {}'.format(
+                                ' -> '.join(i._entry_name for i in cycle)))
+                    if dep not in visited:
+                        path.append(dep)
+                        stack.append(iter(self.dependencies[dep]))
+                        visiting.add(dep)
+                        break
+                else:
+                    entry = path.pop()
+                    stack.pop()
+                    visiting.discard(entry)
+                    visited.add(entry)
+                    order.append(entry)
+        return order
+
+    def closure(self, entry):
+        """All the entries `entry` depends on, directly or transitively"""
+        try:
+            return self._closures[entry]
+        except KeyError:
+            pass
+        # fill in topological order so that closures of the dependencies
+        # are always ready, no recursion needed
+        for i in self.order:
+            if i in self._closures:
+                continue
+            deps = set(self.dependencies[i])
+            for dep in self.dependencies[i]:
+                deps |= self._closures[dep]
+            self._closures[i] = frozenset(deps)
+        return self._closures[entry]
+
+    def reverse_closure(self, entry):
+        """All the entries that depend on `entry`, directly or transitively"""
+        try:
+            return self._reverse_closures[entry]
+        except KeyError:
+            pass
+        for i in reversed(self.order):
+            if i in self._reverse_closures:
+                continue
+            dependents = set(self.dependents[i])
+            for dependent in self.dependents[i]:
+                dependents |= self._reverse_closures[dependent]
+            self._reverse_closures[i] = frozenset(dependents)
+        return self._reverse_closures[entry]
+
+    def closure_of(self, entries):
+        """`entries` together with everything they depend on"""
+        result = set(entries)
+        for entry in entries:
+            result |= self.closure(entry)
+        return result
+
+    def sorted(self, entries):
+        """Sort `entries` by the order they are defined in the graph"""
+        return sorted(entries, key=self.index.__getitem__)
+
+    def components(self, entries):
+        """Split `entries` into weakly connected components, entries in
+        different components never depend on each other
+        """
+        entries = set(entries)
+        seen = set()
+        components = []
+        for root in self.sorted(entries):
+            if root in seen:
+                continue
+            seen.add(root)
+            component = []
+            stack = [root]
+            while stack:
+                entry = stack.pop()
+                component.append(entry)
+                for i in self.dependencies[entry] + self.dependents[entry]:
+                    if i in entries and i not in seen:
+                        seen.add(i)
+                        stack.append(i)
+            components.append(self.sorted(component))
+        return components
+
+    def critical_path(self, entries, weights):
+        """The chain of dependent entries with the largest total weight,
+        returns the total and the chain, dependencies first
+        """
+        entries = set(entries)
+        totals = {}
+        previous = {}
+        for entry in self.order:
+            if entry not in entries:
+                continue
+            best = None
+            for dep in self.dependencies[entry]:
+                if dep in entries and (best is None or totals[dep] > totals[best]):
+                    best = dep
+            previous[entry] = best
+            totals[entry] = weights[entry] + (totals[best] if best is not None else 0)
+
+        if not totals:
+            return 0, []
+        entry = max(self.sorted(totals), key=totals.__getitem__)
+        total = totals[entry]
+        path = []
+        while entry is not None:
+            path.append(entry)
+            entry = previous[entry]
+        path.reverse()
+        return total, path
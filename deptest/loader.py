@@ -2,22 +2,147 @@
 
 import os
 import sys
+import ast
 import imp
 import logging
 
 lg = logging.getLogger('deptest.loader')
 
+# set by `module_depend_on` in the globals of a test module
+MODULE_DEPENDENCIES_ATTR = '__deptest_module_dependencies__'
+
 
 def load_module_from_path(filepath):
-    # add path
-    dirpath = os.path.dirname(filepath)
-    sys.path.insert(0, dirpath)
+    # add path, only once for all the modules in the same dir, so that
+    # modules can always import their siblings
+    dirpath = os.path.abspath(os.path.dirname(filepath))
+    if dirpath not in sys.path:
+        sys.path.insert(0, dirpath)
 
     module_name = os.path.basename(filepath).split('.')[0]
     lg.debug('load module %s from %s, at %s', module_name, filepath, os.getcwd())
-    module = imp.load_source(module_name, filepath)
+    # load as source, imp reuses the compiled .pyc next to the file if it's
+    # up to date, and writes it if not
+    with open(filepath, 'U') as f:
+        module = imp.load_module(module_name, f, filepath, ('.py', 'U', imp.PY_SOURCE))
+
+    return module
+
+
+def may_define_entries(filepath, entry_pattern):
+    """Parse the module without running it, returns False only if it
+    surely binds no names matching `entry_pattern`
+    """
+    try:
+        with open(filepath, 'U') as f:
+            tree = ast.parse(f.read(), filepath)
+    except (IOError, SyntaxError) as e:
+        # let loading the module report the error
+        lg.debug('prescan %s failed: %s', filepath, e)
+        return True
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.alias) and node.name == '*':
+            return True
+        name = _bound_name(node)
+        if name is not None and entry_pattern.match(name):
+            return True
+    lg.debug('prescan %s: no entries', filepath)
+    return False
+
+
+class StaticFunction(object):
+    """Stands for a function found by parsing, it's never called"""
+
+    def __init__(self, name, dependencies, lineno):
+        self.__name__ = name
+        self.dependencies = dependencies
+        self.lineno = lineno
+
 
-    # remove path
-    del sys.path[0]
+def static_module_from_path(filepath, entry_pattern):
+    """Build a module from the source without running it, only functions
+    matching `entry_pattern` and their `depend_on` decorators are
+    extracted, returns None if they can't be known statically
+    """
+    with open(filepath, 'U') as f:
+        tree = ast.parse(f.read(), filepath)
 
+    module_name = os.path.basename(filepath).split('.')[0]
+    module = imp.new_module(module_name)
+    module.__file__ = filepath
+    module_dependencies = []
+
+    static_nodes = set()
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef) and entry_pattern.match(node.name):
+            dependencies = []
+            # decorators are applied from bottom to top
+            for decorator in reversed(node.decorator_list):
+                if not _is_call_of(decorator, 'depend_on'):
+                    # may be `depend_on` under another name, or change
+                    # the function in any other way
+                    lg.debug('unknown decorator of %s in %s', node.name, filepath)
+                    return None
+                try:
+                    dependencies.append(_depend_on_args(decorator))
+                except ValueError:
+                    lg.debug('dynamic depend_on of %s in %s', node.name, filepath)
+                    return None
+            setattr(module, node.name, StaticFunction(node.name, dependencies, node.lineno))
+            static_nodes.add(node)
+        elif isinstance(node, ast.Expr) and _is_call_of(node.value, 'module_depend_on'):
+            try:
+                module_dependencies.extend(ast.literal_eval(node.value.args[0]))
+            except (ValueError, IndexError):
+                lg.debug('dynamic module_depend_on in %s', filepath)
+                return None
+
+    # entries defined in any other way are only known by running the module
+    for node in ast.walk(tree):
+        if node in static_nodes:
+            continue
+        if isinstance(node, ast.alias) and node.name == '*':
+            return None
+        name = _bound_name(node)
+        if name is not None and entry_pattern.match(name):
+            lg.debug('dynamic entry %s in %s', name, filepath)
+            return None
+
+    if module_dependencies:
+        setattr(module, MODULE_DEPENDENCIES_ATTR, module_dependencies)
     return module
+
+
+def _is_call_of(node, name):
+    """Whether `node` calls `name` or `deptest.name`"""
+    if not isinstance(node, ast.Call):
+        return False
+    func = node.func
+    if isinstance(func, ast.Name):
+        return func.id == name
+    if isinstance(func, ast.Attribute):
+        return func.attr == name and isinstance(func.value, ast.Name) and func.value.id == 'deptest'
+    return False
+
+
+def _depend_on_args(node):
+    """Arguments of a `depend_on` call, raises ValueError if not literal"""
+    values = [ast.literal_eval(i) for i in node.args]
+    keywords = dict((i.arg, ast.literal_eval(i.value)) for i in node.keywords)
+    if node.starargs or node.kwargs or not values:
+        raise ValueError('not literal')
+    return {
+        'name': values[0],
+        'with_return': bool(values[1] if len(values) > 1 else keywords.get('with_return', False)),
+    }
+
+
+def _bound_name(node):
+    if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+        return node.name
+    if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+        return node.id
+    if isinstance(node, ast.alias):
+        return node.asname or node.name.split('.')[-1]
+    return None
@@ -1,15 +1,26 @@
 # coding: utf-8
 
+import re
 import sys
 import curses
 import logging
 import threading
-from .utils import anyp, unicode_type, to_unicode
+import contextlib
+import collections
+from .utils import unicode_type, to_unicode
 
 lg = logging.getLogger('deptest.log')
 
+_setup_lock = threading.Lock()
 
-def setup_log_handler(log_handler, clear=False):
+
+def setup_log_handler(log_handler, clear=False, level=logging.NOTSET):
+    # entries running in threads may call this at the same time
+    with _setup_lock:
+        _setup_log_handler(log_handler, clear, level)
+
+
+def _setup_log_handler(log_handler, clear=False, level=logging.NOTSET):
     # setup our handler with root logger
     root_logger = logging.getLogger()
     if clear:
@@ -31,9 +42,9 @@ def setup_log_handler(log_handler, clear=False):
             root_logger.handlers.remove(handler)
     root_logger.addHandler(log_handler)
     lg.debug('root logger handlers: %s', root_logger.handlers)
-    # to make sure everything gets captured
-    loglevel = "NOTSET"
-    root_logger.setLevel(getattr(logging, loglevel))
+    # NOTSET makes sure everything gets captured, a higher level stops
+    # loggers from creating records below it at all
+    root_logger.setLevel(level)
 
 
 def set_logger(name,
@@ -66,23 +77,66 @@ def set_logger(name,
 
 
 class MyMemoryHandler(logging.Handler):
-    def __init__(self, logformat, logdatefmt=None, filters=None):
+    """Keep the last `capacity` records, records are only formatted when
+    asked for by `formatted`. Records of all threads go to one buffer,
+    so that logging of threads started by an entry is captured too,
+    except while entries run in threads, see `threaded`
+    """
+
+    def __init__(self, logformat, logdatefmt=None, filters=None, capacity=None):
         logging.Handler.__init__(self)
         fmt = logging.Formatter(logformat, logdatefmt)
         self.setFormatter(fmt)
         if filters is None:
             filters = ['-deptest']
         self.filterset = FilterSet(filters)
-        self.buffer = []
+        self.capacity = capacity
+        self._shared = collections.deque(maxlen=capacity)
+        self._local = threading.local()
+        # depth of `threaded` blocks
+        self._threaded = 0
+        self._threaded_lock = threading.Lock()
+
+    @property
+    def buffer(self):
+        if not self._threaded:
+            return self._shared
+        try:
+            return self._local.buffer
+        except AttributeError:
+            self._local.buffer = collections.deque(maxlen=self.capacity)
+            return self._local.buffer
+
+    @contextlib.contextmanager
+    def threaded(self):
+        """Keep a buffer for each thread in the block, each thread captures
+        logging of the entry it runs
+        """
+        with self._threaded_lock:
+            self._threaded += 1
+        try:
+            yield
+        finally:
+            with self._threaded_lock:
+                self._threaded -= 1
+                if not self._threaded:
+                    # drop buffers of the threads
+                    self._local = threading.local()
 
     def emit(self, record):
-        self.buffer.append(self.format(record))
+        self.buffer.append(record)
+
+    def formatted(self):
+        return [self.format(record) for record in self.buffer]
 
     def flush(self):
         pass
 
     def truncate(self):
-        self.buffer = []
+        if self._threaded:
+            self._local.buffer = collections.deque(maxlen=self.capacity)
+        else:
+            self._shared.clear()
 
     def filter(self, record):
         if self.filterset.allow(record.name):
@@ -91,16 +145,31 @@ class MyMemoryHandler(logging.Handler):
     def __getstate__(self):
         state = self.__dict__.copy()
         del state['lock']
+        del state['_local']
+        del state['_threaded_lock']
+        state['_shared'] = None
         return state
 
     def __setstate__(self, state):
         self.__dict__.update(state)
         self.lock = threading.RLock()
+        self._shared = collections.deque(maxlen=self.capacity)
+        self._local = threading.local()
+        self._threaded = 0
+        self._threaded_lock = threading.Lock()
 
 
 class FilterSet(object):
+    """Include and exclude logger names by prefix, prefixes are compiled
+    into one regex each, and the decision for a name is cached since
+    there are only a few distinct logger names
+    """
+
     def __init__(self, filter_components):
         self.inclusive, self.exclusive = self._partition(filter_components)
+        self._inclusive = self._compile(self.inclusive)
+        self._exclusive = self._compile(self.exclusive)
+        self._decisions = {}
 
     # @staticmethod
     def _partition(components):
@@ -113,31 +182,34 @@ class FilterSet(object):
         return inclusive, exclusive
     _partition = staticmethod(_partition)
 
+    # @staticmethod
+    def _compile(keys):
+        """regex that matches a record which is any of `keys`,
+        or starts with any of `keys` followed by a dot"""
+        if not keys:
+            return None
+        return re.compile(r'(?:{})(?:\.|$)'.format('|'.join(re.escape(i) for i in keys)))
+    _compile = staticmethod(_compile)
+
     def allow(self, record):
         """returns whether this record should be printed"""
-        if not self:
-            # nothing to filter
-            return True
-        return self._allow(record) and not self._deny(record)
-
-    # @staticmethod
-    def _any_match(matchers, record):
-        """return the bool of whether `record` starts with
-        any item in `matchers`"""
-        def record_matches_key(key):
-            return record == key or record.startswith(key + '.')
-        return anyp(bool, map(record_matches_key, matchers))
-    _any_match = staticmethod(_any_match)
+        try:
+            return self._decisions[record]
+        except KeyError:
+            pass
+        allowed = self._allow(record) and not self._deny(record)
+        self._decisions[record] = allowed
+        return allowed
 
     def _allow(self, record):
-        if not self.inclusive:
+        if self._inclusive is None:
             return True
-        return self._any_match(self.inclusive, record)
+        return self._inclusive.match(record) is not None
 
     def _deny(self, record):
-        if not self.exclusive:
+        if self._exclusive is None:
             return False
-        return self._any_match(self.exclusive, record)
+        return self._exclusive.match(record) is not None
 
 
 class Color(object):
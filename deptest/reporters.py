@@ -0,0 +1,130 @@
+# coding: utf-8
+
+"""Reporters receive the result of each entry as soon as it finishes,
+and write it out in a machine readable format
+"""
+
+import re
+import json
+import shutil
+import logging
+import tempfile
+from xml.sax.saxutils import escape, quoteattr
+
+lg = logging.getLogger('deptest.reporters')
+
+
+class Reporter(object):
+    """Base class of reporters, `entry_finished` is called in the order
+    entries finish, with the record made by `make_record`
+    """
+
+    # keep captured output of passing entries for the records
+    wants_output = False
+
+    def entry_finished(self, record):
+        pass
+
+    def finish(self):
+        pass
+
+
+def make_record(entry, state, status, dependencies):
+    module_name = entry._module_runner.module.__name__
+    return {
+        'name': '{}:{}'.format(module_name, entry._entry_name),
+        'module': module_name,
+        'entry': entry._entry_name,
+        'status': status,
+        'cached': state.cached,
+        'duration': state.duration,
+        'cpu_time': state.cpu_time,
+        'timings': state.timings,
+        'dependencies': ['{}:{}'.format(i._module_runner.module.__name__, i._entry_name)
+                         for i in dependencies],
+        'traceback': to_text(state.traceback),
+        'captured_stdout': to_text(state.captured_stdout),
+        'captured_logging': [to_text(i) for i in state.captured_logging or []],
+    }
+
+
+def to_text(s):
+    if isinstance(s, str):
+        return s.decode('utf-8', 'replace')
+    return s
+
+
+class JSONLinesReporter(Reporter):
+    """Write one JSON object per line, flushed after each entry so that
+    the file can be followed while running
+    """
+
+    wants_output = True
+
+    def __init__(self, path):
+        self.f = open(path, 'w')
+
+    def entry_finished(self, record):
+        self.f.write(json.dumps(record))
+        self.f.write('\n')
+        self.f.flush()
+
+    def finish(self):
+        self.f.close()
+
+
+# characters not allowed in XML 1.0
+_invalid_xml_chars = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def xml_text(s):
+    return escape(_invalid_xml_chars.sub(u'?', s)).encode('utf-8')
+
+
+def xml_attr(s):
+    return quoteattr(_invalid_xml_chars.sub(u'?', s)).encode('utf-8')
+
+
+class JUnitXMLReporter(Reporter):
+    """Write a JUnit XML file. Test cases are streamed to a temporary file
+    as they finish, and copied after the header once the counts are known
+    """
+
+    wants_output = True
+
+    def __init__(self, path):
+        self.path = path
+        self.cases = tempfile.TemporaryFile()
+        self.counts = {'tests': 0, 'failures': 0, 'skipped': 0}
+        self.time = 0
+
+    def entry_finished(self, record):
+        self.counts['tests'] += 1
+        duration = record['duration'] or 0
+        self.time += duration
+
+        w = self.cases.write
+        w('  <testcase classname={} name={} time="{:.6f}">\n'.format(
+            xml_attr(record['module']), xml_attr(record['entry']), duration))
+        if record['status'] == 'FAILED':
+            self.counts['failures'] += 1
+            w('    <failure message="FAILED">{}</failure>\n'.format(
+                xml_text(record['traceback'] or u'')))
+        elif record['status'] == 'UNMET':
+            self.counts['skipped'] += 1
+            w('    <skipped message="UNMET"/>\n')
+        if record['captured_stdout']:
+            w('    <system-out>{}</system-out>\n'.format(xml_text(record['captured_stdout'])))
+        if record['captured_logging']:
+            w('    <system-err>{}</system-err>\n'.format(xml_text(u'\n'.join(record['captured_logging']))))
+        w('  </testcase>\n')
+
+    def finish(self):
+        with open(self.path, 'w') as f:
+            f.write('<?xml version="1.0" encoding="utf-8"?>\n')
+            f.write('<testsuite name="deptest" tests="{c[tests]}" failures="{c[failures]}" '
+                    'errors="0" skipped="{c[skipped]}" time="{t:.6f}">\n'.format(c=self.counts, t=self.time))
+            self.cases.seek(0)
+            shutil.copyfileobj(self.cases, f)
+            f.write('</testsuite>\n')
+        self.cases.close()
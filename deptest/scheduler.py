@@ -0,0 +1,199 @@
+# coding: utf-8
+
+"""Schedulers that decide in which order entries of a graph are run
+"""
+
+import heapq
+import logging
+
+lg = logging.getLogger('deptest.scheduler')
+
+
+class Scheduler(object):
+    """Kahn style scheduler, each entry is handed out exactly once and only
+    after all of its dependencies are marked done.
+
+    Ready entries are ordered by their priority (lower first, 0 by default)
+    and then by their index in the graph, so the resulting order is
+    deterministic and stable across runs.
+
+    Resources declared by `uses` are reader-writer locks held from `pop`
+    to `done`: a ready entry is skipped while it conflicts with a running
+    one, and the next ready entry that does not conflict is handed out.
+    """
+
+    def __init__(self, graph, entries, priorities=None):
+        self.graph = graph
+        self.entries = set(entries)
+        self.priorities = priorities or {}
+        self.indegrees = {}
+        self.ready = []
+        # resource -> number of running readers, or -1 while written
+        self.holders = {}
+
+        for entry in self.entries:
+            indegree = 0
+            for dep in graph.dependencies[entry]:
+                if dep in self.entries:
+                    indegree += 1
+            self.indegrees[entry] = indegree
+            if not indegree:
+                self._push(entry)
+
+    def _push(self, entry):
+        key = (self.priorities.get(entry, 0), self.graph.index[entry])
+        heapq.heappush(self.ready, (key, entry))
+
+    def pop(self):
+        """Returns the next ready entry whose resources are free, or None
+        if there is no such entry
+        """
+        skipped = []
+        entry = None
+        while self.ready:
+            item = heapq.heappop(self.ready)
+            if self._can_acquire(item[1]):
+                entry = item[1]
+                break
+            skipped.append(item)
+        for item in skipped:
+            heapq.heappush(self.ready, item)
+        if entry is not None:
+            self._acquire(entry)
+        return entry
+
+    def _can_acquire(self, entry):
+        for i in getattr(entry, 'resources', ()):
+            held = self.holders.get(i['name'], 0)
+            if held < 0 or (held and i['mode'] == 'write'):
+                return False
+        return True
+
+    def _acquire(self, entry):
+        for i in getattr(entry, 'resources', ()):
+            if i['mode'] == 'write':
+                self.holders[i['name']] = -1
+            else:
+                self.holders[i['name']] = self.holders.get(i['name'], 0) + 1
+
+    def _release(self, entry):
+        for i in getattr(entry, 'resources', ()):
+            if i['mode'] == 'write':
+                self.holders[i['name']] = 0
+            else:
+                self.holders[i['name']] -= 1
+
+    def done(self, entry):
+        """Mark `entry` as done, its dependents may become ready"""
+        self._release(entry)
+        for dependent in self.graph.dependents[entry]:
+            if dependent not in self.indegrees:
+                continue
+            self.indegrees[dependent] -= 1
+            if not self.indegrees[dependent]:
+                self._push(dependent)
+
+    def __iter__(self):
+        """Run sequentially, every entry yielded is considered done when
+        the next one is asked for
+        """
+        entry = self.pop()
+        while entry is not None:
+            yield entry
+            self.done(entry)
+            entry = self.pop()
+
+
+def partition(groups, weight, count):
+    """Split `groups` into `count` bins with balanced total weights, by
+    placing the heaviest group first into the lightest bin. The result
+    only depends on the arguments, so every shard computes the same bins
+    """
+    bins = [[] for _ in range(count)]
+    totals = [0] * count
+    weighted = [(-weight(group), i, group) for i, group in enumerate(groups)]
+    for w, _, group in sorted(weighted):
+        lightest = min(range(count), key=lambda i: (totals[i], i))
+        bins[lightest].append(group)
+        totals[lightest] -= w
+    return bins, totals
+
+
+def merge_conflicting(components):
+    """Merge components whose entries use a resource that any of them
+    writes, so that they run in the same process and can be scheduled
+    against each other
+    """
+    parents = range(len(components))
+
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    users = {}
+    for i, component in enumerate(components):
+        for entry in component:
+            for resource in getattr(entry, 'resources', ()):
+                users.setdefault(resource['name'], []).append((i, resource['mode']))
+    for name, items in users.iteritems():
+        if any(mode == 'write' for _, mode in items):
+            root = find(items[0][0])
+            for i, _ in items[1:]:
+                parents[find(i)] = root
+
+    merged = {}
+    order = []
+    for i, component in enumerate(components):
+        root = find(i)
+        if root not in merged:
+            merged[root] = []
+            order.append(root)
+        merged[root].extend(component)
+    return [merged[i] for i in order]
+
+
+def select_within_budget(graph, entries, cost, value, budget):
+    """Select entries of `entries` whose total `cost` fits in `budget`,
+    together with everything they depend on. Greedily takes the entry
+    whose missing dependency closure brings the most value per cost, ties
+    are broken by the index in the graph so the result is deterministic.
+
+    Candidates are kept in a heap, and only the ones depending on newly
+    selected entries are computed again, an item whose group changed
+    since it was pushed is skipped.
+    """
+    candidates = set(entries)
+    selected = set()
+    total = 0
+    # entry -> (group of entries it brings in, their cost)
+    groups = {}
+    heap = []
+
+    def push(entry):
+        group = (graph.closure(entry) | set([entry])) - selected
+        group_cost = sum(cost(i) for i in group)
+        ratio = sum(value(i) for i in group) / float(group_cost or 1e-9)
+        groups[entry] = (group, group_cost)
+        heapq.heappush(heap, (-ratio, graph.index[entry], entry, group))
+
+    for entry in candidates:
+        push(entry)
+    while heap:
+        _, _, entry, group = heapq.heappop(heap)
+        if entry not in candidates or groups[entry][0] is not group:
+            continue
+        group_cost = groups[entry][1]
+        # pushed again if its group shrinks
+        if total + group_cost > budget:
+            continue
+        selected |= group
+        total += group_cost
+        candidates -= group
+        affected = set()
+        for i in group:
+            affected |= graph.reverse_closure(i)
+        for i in affected & candidates:
+            push(i)
+    return selected, total
@@ -0,0 +1,119 @@
+# coding: utf-8
+
+"""Results of entries
+"""
+
+OK, FAILED, UNMET = range(3)
+
+STATUS_NAMES = ['OK', 'FAILED', 'UNMET']
+
+
+class EntryState(object):
+    """Result of running an entry. An entry not run yet is FAILED, so that
+    anything going wrong before it passes counts as a failure
+    """
+
+    __slots__ = ('status', 'cached', 'executed', 'duration', 'cpu_time', 'timings',
+                 'return_value', 'traceback', 'captured_stdout', 'captured_logging')
+
+    def __init__(self):
+        self.status = FAILED
+        self.cached = False
+        self.executed = False
+        self.duration = None
+        self.cpu_time = None
+        self.timings = None
+        self.return_value = None
+        self.traceback = None
+        self.captured_stdout = None
+        self.captured_logging = None
+
+    @property
+    def ok(self):
+        return self.status == OK
+
+    @property
+    def status_name(self):
+        return STATUS_NAMES[self.status]
+
+    # slots have no __dict__ to be pickled, states are sent back from
+    # worker processes
+    def __getstate__(self):
+        return [getattr(self, i) for i in self.__slots__]
+
+    def __setstate__(self, values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+
+class StateTable(object):
+    """States of the entries of a graph, in a list indexed by the position
+    of the entry in the graph. A state is created when first asked for.
+
+    Entries are counted by status when `finish` is called, so that the
+    summary does not have to look at every state again.
+    """
+
+    def __init__(self, graph):
+        self.index = graph.index
+        self.entries = graph.entries
+        self._states = [None] * len(graph.entries)
+        # (status, cached) each finished entry is counted as
+        self._counted = [None] * len(graph.entries)
+        self.counts = [0] * len(STATUS_NAMES)
+        self.cached = 0
+
+    def __getitem__(self, entry):
+        i = self.index[entry]
+        state = self._states[i]
+        if state is None:
+            state = self._states[i] = EntryState()
+        return state
+
+    def __setitem__(self, entry, state):
+        i = self.index[entry]
+        self._uncount(i)
+        self._states[i] = state
+
+    def __contains__(self, entry):
+        i = self.index.get(entry)
+        return i is not None and self._states[i] is not None
+
+    def __iter__(self):
+        for i, state in enumerate(self._states):
+            if state is not None:
+                yield self.entries[i]
+
+    def __len__(self):
+        return len(self._states) - self._states.count(None)
+
+    def iteritems(self):
+        for i, state in enumerate(self._states):
+            if state is not None:
+                yield self.entries[i], state
+
+    def finish(self, entry):
+        """Count `entry` by its current status"""
+        i = self.index[entry]
+        self._uncount(i)
+        state = self._states[i]
+        if state.cached:
+            self.cached += 1
+        else:
+            self.counts[state.status] += 1
+        self._counted[i] = (state.status, state.cached)
+
+    def _uncount(self, i):
+        if self._counted[i] is None:
+            return
+        status, cached = self._counted[i]
+        if cached:
+            self.cached -= 1
+        else:
+            self.counts[status] -= 1
+        self._counted[i] = None
+
+    def is_finished(self, entry):
+        """Whether `entry` is counted by `finish`"""
+        i = self.index.get(entry)
+        return i is not None and self._counted[i] is not None
@@ -0,0 +1,146 @@
+# coding: utf-8
+
+"""Store of return values passed to dependents by `with_return`
+"""
+
+import sys
+import types
+import logging
+import tempfile
+import threading
+import cPickle as pickle
+
+lg = logging.getLogger('deptest.store')
+
+
+class ReturnStore(object):
+    """Holds the return value of an entry until every dependent taking it
+    has finished. `refcounts` is the number of such dependents of each
+    entry, values of entries not in it are never stored.
+
+    Values bigger than `spill_size` bytes are pickled to a temporary file
+    and loaded again for each dependent. With `keep` values are never
+    released, for runs that may be repeated. Sizes are only measured with
+    `spill_size` or `measure`, `peak` stays 0 otherwise.
+    """
+
+    def __init__(self, refcounts, spill_size=None, keep=False, measure=False):
+        self.refcounts = dict(refcounts)
+        self.spill_size = spill_size
+        self.keep = keep
+        self.measure = measure or spill_size is not None
+        # entry -> (value, size), or (file, size) if spilled
+        self._values = {}
+        self._spilled = set()
+        self.retained = 0
+        self.peak = 0
+        self.spilled_count = 0
+        self._lock = threading.Lock()
+
+    def put(self, entry, value):
+        if not self.keep and not self.refcounts.get(entry):
+            return
+        # walking a big value is much slower than storing it
+        size = deep_sizeof(value) if self.measure else 0
+        with self._lock:
+            self._drop(entry)
+            if self.spill_size is not None and size > self.spill_size:
+                f = spill(value)
+                if f is not None:
+                    lg.debug('spill return value of %s, %s bytes', entry._entry_name, size)
+                    self._values[entry] = (f, size)
+                    self._spilled.add(entry)
+                    self.spilled_count += 1
+                    return
+            self._values[entry] = (value, size)
+            self.retained += size
+            self.peak = max(self.peak, self.retained)
+
+    def get(self, entry):
+        with self._lock:
+            if entry not in self._values:
+                return None
+            value, _ = self._values[entry]
+            if entry not in self._spilled:
+                return value
+            value.seek(0)
+            return pickle.load(value)
+
+    def release(self, entry):
+        """A dependent taking the value of `entry` has finished"""
+        with self._lock:
+            if entry not in self.refcounts:
+                return
+            self.refcounts[entry] -= 1
+            if self.refcounts[entry] <= 0 and not self.keep:
+                lg.debug('release return value of %s', entry._entry_name)
+                self._drop(entry)
+
+    def take(self, entry, store, old_entry):
+        """Move the value of `old_entry` from `store` to `entry`"""
+        with store._lock:
+            if old_entry not in store._values:
+                return
+            item = store._values.pop(old_entry)
+            spilled = old_entry in store._spilled
+            store._spilled.discard(old_entry)
+            if not spilled:
+                store.retained -= item[1]
+        with self._lock:
+            self._drop(entry)
+            self._values[entry] = item
+            if spilled:
+                self._spilled.add(entry)
+            else:
+                self.retained += item[1]
+                self.peak = max(self.peak, self.retained)
+
+    def _drop(self, entry):
+        if entry not in self._values:
+            return
+        value, size = self._values.pop(entry)
+        if entry in self._spilled:
+            self._spilled.remove(entry)
+            value.close()
+        else:
+            self.retained -= size
+
+
+def spill(value):
+    """Pickle `value` to a temporary file, or returns None if it can't be
+    pickled
+    """
+    f = tempfile.TemporaryFile()
+    try:
+        pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+        lg.debug('can not spill %r: %s', type(value), e)
+        f.close()
+        return None
+    return f
+
+
+def deep_sizeof(value):
+    """Approximate memory used by `value` and the containers and instances
+    reachable from it, every object is counted once
+    """
+    seen = set()
+    size = 0
+    stack = [value]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        try:
+            size += sys.getsizeof(obj)
+        except TypeError:
+            continue
+        if isinstance(obj, dict):
+            stack.extend(obj.iterkeys())
+            stack.extend(obj.itervalues())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif hasattr(obj, '__dict__') and not isinstance(obj, (type, types.ModuleType)):
+            stack.append(obj.__dict__)
+    return size
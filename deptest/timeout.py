@@ -0,0 +1,222 @@
+# coding: utf-8
+
+"""Watchdog that interrupts entries running past their deadlines
+"""
+
+import os
+import sys
+import time
+import ctypes
+import signal
+import logging
+import contextlib
+import tempfile
+import threading
+import traceback
+try:
+    import faulthandler
+except ImportError:
+    faulthandler = None
+
+lg = logging.getLogger('deptest.timeout')
+
+
+class EntryTimeout(Exception):
+    """Raised in an entry that runs past its deadline"""
+
+
+def timeout(seconds):
+    """Fail the entry if it runs longer than `seconds`, overrides
+    `--timeout`
+    """
+    def decorator_func(f):
+        f.timeout = seconds
+        return f
+
+    return decorator_func
+
+
+def dump_stacks():
+    """Returns the stacks of all threads"""
+    if faulthandler is not None:
+        with tempfile.TemporaryFile() as f:
+            faulthandler.dump_traceback(f, all_threads=True)
+            f.seek(0)
+            return f.read()
+
+    names = dict((i.ident, i.name) for i in threading.enumerate())
+    lines = []
+    for ident, frame in sys._current_frames().items():
+        lines.append('Thread {} ({}):\n'.format(names.get(ident, '?'), ident))
+        lines.extend(traceback.format_stack(frame))
+        lines.append('\n')
+    return ''.join(lines)
+
+
+def raise_in_thread(ident, exc_class):
+    """Raise `exc_class` in thread `ident` when it runs Python code next,
+    or clear a pending one if `exc_class` is None
+    """
+    ctypes.pythonapi.PyThreadState_SetAsyncExc(
+        ctypes.c_long(ident), ctypes.py_object(exc_class) if exc_class else None)
+
+
+class Watchdog(object):
+    """Checks the deadlines of running entries in a thread. An entry in
+    the main thread is interrupted with SIGALRM, which also breaks out of
+    blocking system calls, an entry in another thread gets `EntryTimeout`
+    raised asynchronously, which only happens once it runs Python code.
+
+    Either is only raised inside `calling`, so that a late interruption
+    never escapes the code catching errors of the entry. The signal handler
+    takes no lock, the main thread may be in the middle of taking it.
+    """
+
+    interval = 0.1
+    # seconds to wait for an interrupted entry before giving up on it
+    abandon_after = 1.0
+
+    def __init__(self):
+        # thread ident -> (deadline, name, whether it's the main thread,
+        # callback when given up)
+        self.running = {}
+        # thread ident -> reason, for entries interrupted
+        self.fired = {}
+        # idents of the threads inside `calling`
+        self.calling_threads = set()
+        # a lock written in C, an asynchronous exception can't break it
+        # half taken
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = None
+        self._pid = None
+        # reason the main thread is interrupted for, and whether it's
+        # calling the entry, only read by the signal handler
+        self._alarm = None
+        self._calling = False
+
+    def start(self):
+        """Install the signal handler, must be called in the main thread"""
+        signal.signal(signal.SIGALRM, self._on_alarm)
+
+    def _ensure_thread(self):
+        # threads don't survive fork, worker processes start their own
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        self._pid = os.getpid()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._loop, args=(self._stopped, ), name='deptest-watchdog')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the thread, so that it's not left running when the
+        interpreter exits, `watch` starts it again
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if self._stopped is not None:
+                self._stopped.set()
+        if thread is not None and self._pid == os.getpid():
+            thread.join()
+
+    def watch(self, deadline, name, on_abandon=None):
+        """Watch the entry running in the current thread, `name` is the
+        reason reported when it's interrupted. If it's still running a while
+        after that, `on_abandon` is called with the reason and the thread
+        is not watched any more
+        """
+        thread = threading.current_thread()
+        with self._lock:
+            self._ensure_thread()
+            self.running[thread.ident] = (
+                deadline, name, isinstance(thread, threading._MainThread), on_abandon)
+
+    def unwatch(self):
+        """Stop watching the current thread, returns the reason if the
+        entry was interrupted
+        """
+        ident = threading.current_thread().ident
+        with self._lock:
+            if ident not in self.running:
+                # abandoned after it was interrupted
+                raise_in_thread(ident, None)
+                return None
+            deadline, name, main, _ = self.running.pop(ident)
+            reason = self.fired.pop(ident, None)
+            if main:
+                self._alarm = None
+            elif reason is not None:
+                # the exception may not be raised yet
+                raise_in_thread(ident, None)
+        return reason
+
+    @contextlib.contextmanager
+    def calling(self):
+        """Block in which the watched entry can be interrupted, the errors
+        it raises must be caught around it
+        """
+        thread = threading.current_thread()
+        main = isinstance(thread, threading._MainThread)
+        with self._lock:
+            self.calling_threads.add(thread.ident)
+            # interrupted before the block
+            reason = self.fired.get(thread.ident) if thread.ident in self.running else None
+        if main:
+            self._calling = True
+        try:
+            if reason is not None:
+                raise EntryTimeout(reason)
+            yield
+        finally:
+            if main:
+                self._calling = False
+            with self._lock:
+                self.calling_threads.discard(thread.ident)
+                if not main:
+                    # the exception may not be raised yet, `unwatch`
+                    # still returns the reason
+                    raise_in_thread(thread.ident, None)
+
+    def _on_alarm(self, signum, frame):
+        reason = self._alarm
+        if reason is not None and self._calling:
+            # raised once for each interruption
+            self._alarm = None
+            raise EntryTimeout(reason)
+
+    def _loop(self, stopped):
+        while not stopped.wait(self.interval):
+            now = time.time()
+            expired = []
+            abandoned = []
+            with self._lock:
+                for ident, (deadline, name, _, on_abandon) in self.running.items():
+                    if ident not in self.fired:
+                        if now > deadline:
+                            expired.append((ident, name))
+                    elif on_abandon is not None and now > deadline + self.abandon_after:
+                        del self.running[ident]
+                        abandoned.append((on_abandon, self.fired.pop(ident)))
+            for ident, name in expired:
+                self._interrupt(ident, name)
+            for on_abandon, reason in abandoned:
+                on_abandon(reason)
+
+    def _interrupt(self, ident, name):
+        lg.error('%s, stacks of all threads:\n%s', name, dump_stacks())
+        with self._lock:
+            # the entry may have finished, and another one started
+            if self.running.get(ident, (None, None))[1] != name:
+                return
+            main = self.running[ident][2]
+            self.fired[ident] = name
+            if ident not in self.calling_threads:
+                # raised when it enters `calling`, or reported by `unwatch`
+                return
+            if main:
+                self._alarm = name
+                os.kill(os.getpid(), signal.SIGALRM)
+            else:
+                raise_in_thread(ident, EntryTimeout)
+
@@ -3,7 +3,10 @@
 """Util functions for deptest project, unlike tools, it's only for internal use
 """
 
+import os
 import re
+import timeit
+import contextlib
 
 
 LINE_WIDTH = 70
@@ -65,6 +68,25 @@ def safe_str(val, encoding='utf-8'):
         return unicode(val).encode(encoding)
 
 
+wall_time = timeit.default_timer
+
+
+def cpu_time():
+    """User and system CPU time of the process"""
+    t = os.times()
+    return t[0] + t[1]
+
+
+@contextlib.contextmanager
+def timed(timings, key):
+    """Add the wall time spent in the block to `timings[key]`"""
+    start = wall_time()
+    try:
+        yield
+    finally:
+        timings[key] = timings.get(key, 0) + wall_time() - start
+
+
 def merge_list(a, b):
     for i in b:
         if i not in a:
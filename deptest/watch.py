@@ -0,0 +1,52 @@
+# coding: utf-8
+
+"""Polling of file changes for watch mode
+"""
+
+import os
+import logging
+
+lg = logging.getLogger('deptest.watch')
+
+
+def get_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def module_source(module):
+    """Path of the source file of `module`, or None for builtin modules"""
+    path = getattr(module, '__file__', None)
+    if not path:
+        return None
+    if path.endswith(('.pyc', '.pyo')):
+        path = path[:-1]
+    if not path.endswith('.py'):
+        return None
+    return os.path.abspath(path)
+
+
+class FileWatcher(object):
+    """Remembers modification times of files, and tells which of them
+    changed since the last check
+    """
+
+    def __init__(self):
+        self.mtimes = {}
+
+    def add(self, path):
+        path = os.path.abspath(path)
+        if path not in self.mtimes:
+            self.mtimes[path] = get_mtime(path)
+
+    def changed(self):
+        changed = []
+        for path, mtime in self.mtimes.items():
+            new_mtime = get_mtime(path)
+            if new_mtime != mtime:
+                lg.debug('changed: %s', path)
+                self.mtimes[path] = new_mtime
+                changed.append(path)
+        return sorted(changed)
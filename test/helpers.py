@@ -0,0 +1,102 @@
+# coding: utf-8
+
+import os
+import re
+import sys
+import shutil
+import signal
+import tempfile
+import textwrap
+import threading
+import subprocess
+
+from deptest.graph import DependencyGraph
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Entry(object):
+    def __init__(self, name, deps=(), resources=()):
+        self._entry_name = name
+        self.deps = list(deps)
+        self.resources = [{'name': i, 'mode': mode} for i, mode in resources]
+
+    def __repr__(self):
+        return self._entry_name
+
+
+def make_graph(spec):
+    """Graph of entries from `spec`, pairs of the name of an entry and
+    the names it depends on
+    """
+    entries = [Entry(*i) for i in spec]
+    by_name = dict((i._entry_name, i) for i in entries)
+    graph = DependencyGraph(entries, lambda entry: [by_name[i] for i in entry.deps])
+    return graph, by_name
+
+
+def names(entries):
+    return sorted(i._entry_name for i in entries)
+
+
+class Run(object):
+    """Result of running deptest in a subprocess"""
+
+    summary_re = re.compile(r'Ran (\d+) tests, OK (\d+), FAILED (\d+), UNMET (\d+)')
+
+    def __init__(self, returncode, output):
+        self.returncode = returncode
+        self.output = output
+        match = self.summary_re.search(output)
+        if match:
+            self.total, self.ok, self.failed, self.unmet = map(int, match.groups())
+        else:
+            self.total = self.ok = self.failed = self.unmet = None
+
+    @property
+    def counts(self):
+        return self.ok, self.failed, self.unmet
+
+    def status_of(self, name):
+        """Status printed for entry `name`, like `OK` or `UNMET (cached)`"""
+        match = re.search(r'\.{}\.\.\. (.*)$'.format(re.escape(name)), self.output, re.M)
+        return match.group(1).strip() if match else None
+
+
+class TempSuite(object):
+    """Test modules written into a temporary directory"""
+
+    def __init__(self, modules):
+        self.dirpath = tempfile.mkdtemp(prefix='deptest-')
+        for name, source in modules.items():
+            self.write(name, source)
+
+    def write(self, name, source):
+        with open(os.path.join(self.dirpath, name + '.py'), 'w') as f:
+            f.write(textwrap.dedent(source))
+
+    def run(self, *args, **kwargs):
+        """Run deptest with `args` in the directory, it's killed after
+        `kill_after` seconds, or interrupted with Ctrl-C after
+        `interrupt_after` seconds if given
+        """
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        p = subprocess.Popen(
+            [sys.executable, '-c', 'from deptest.core import main; main()'] + list(args),
+            cwd=self.dirpath, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        timer = None
+        if kwargs.get('kill_after'):
+            timer = threading.Timer(kwargs['kill_after'], p.kill)
+            timer.start()
+        elif kwargs.get('interrupt_after'):
+            timer = threading.Timer(kwargs['interrupt_after'], p.send_signal, (signal.SIGINT, ))
+            timer.start()
+        try:
+            output = p.communicate()[0]
+        finally:
+            if timer is not None:
+                timer.cancel()
+        return Run(p.returncode, output)
+
+    def remove(self):
+        shutil.rmtree(self.dirpath, ignore_errors=True)
@@ -0,0 +1,35 @@
+# coding: utf-8
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from deptest.cache import Cache
+
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dirpath = tempfile.mkdtemp(prefix='deptest-')
+        self.cache = Cache(os.path.join(self.dirpath, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.dirpath, ignore_errors=True)
+
+    def test_set_get(self):
+        self.cache.set('results/a', {'return_value': [1, 2]})
+        self.assertEqual(self.cache.get('results/a'), {'return_value': [1, 2]})
+        self.assertIsNone(self.cache.get('results/b'))
+        self.assertTrue(os.path.exists(os.path.join(self.cache.dirpath, '.gitignore')))
+
+    def test_not_picklable(self):
+        with self.assertRaises(Exception):
+            self.cache.set('results/a', {'return_value': threading.Lock()})
+        # no temporary file is left behind
+        self.assertEqual(os.listdir(os.path.join(self.cache.dirpath, 'results')), [])
+        self.assertIsNone(self.cache.get('results/a'))
+
+
+if __name__ == '__main__':
+    unittest.main()
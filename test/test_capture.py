@@ -0,0 +1,85 @@
+# coding: utf-8
+
+import os
+import unittest
+
+from deptest.capture import CaptureBuffer, FDCapture
+
+
+LINES = ''.join('line {}\n'.format(i) for i in range(10))
+
+
+class CaptureBufferTest(unittest.TestCase):
+    def test_in_memory(self):
+        buf = CaptureBuffer(100)
+        buf.write('abc')
+        buf.write(u'é')
+        self.assertIsNone(buf._file)
+        self.assertEqual(buf.getvalue(), 'abc\xc3\xa9')
+        buf.close()
+
+    def test_spill(self):
+        buf = CaptureBuffer(10)
+        buf.write('0123456789')
+        self.assertIsNone(buf._file)
+        buf.write('abc')
+        self.assertIsNotNone(buf._file)
+        self.assertIsNone(buf._buf)
+        buf.write('def')
+        self.assertEqual(buf.size, 16)
+        self.assertEqual(buf.getvalue(), '0123456789abcdef')
+        # reading does not move where the next write goes
+        buf.write('g')
+        self.assertEqual(buf.getvalue(), '0123456789abcdefg')
+        buf.close()
+
+    def test_head_tail(self):
+        for max_size in 1000, 10:
+            buf = CaptureBuffer(max_size)
+            buf.write(LINES)
+            self.assertEqual(
+                buf.getvalue(head=2, tail=1),
+                'line 0\nline 1\n... 7 lines truncated ...\nline 9\n')
+            self.assertEqual(buf.getvalue(tail=2), '... 8 lines truncated ...\nline 8\nline 9\n')
+            self.assertEqual(buf.getvalue(head=2), 'line 0\nline 1\n... 8 lines truncated ...\n')
+            # nothing is skipped
+            self.assertEqual(buf.getvalue(head=5, tail=5), LINES)
+            self.assertEqual(buf.getvalue(head=20), LINES)
+            buf.close()
+
+
+class FDCaptureTest(unittest.TestCase):
+    def capture(self, func):
+        cap = FDCapture()
+        cap.start()
+        try:
+            func(cap)
+        finally:
+            cap.stop()
+        try:
+            return cap.getvalue()
+        finally:
+            cap.close()
+
+    def test_fds(self):
+        def write(cap):
+            print >>cap.stdout, 'print'
+            os.write(1, 'fd 1\n')
+            os.write(2, 'fd 2\n')
+        self.assertEqual(self.capture(write), 'print\nfd 1\nfd 2\n')
+
+    def test_restored(self):
+        fds = [os.fstat(i).st_ino for i in 1, 2]
+        self.capture(lambda cap: None)
+        self.assertEqual([os.fstat(i).st_ino for i in 1, 2], fds)
+
+    def test_unicode(self):
+        def write(cap):
+            print >>cap.stdout, u'café'
+            cap.stdout.write(u'é')
+            cap.stdout.write('\xc3\xa9\n')
+        self.assertEqual(self.capture(write), 'caf\xc3\xa9\n\xc3\xa9\xc3\xa9\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
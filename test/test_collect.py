@@ -0,0 +1,114 @@
+# coding: utf-8
+
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+from deptest.core import scan_dir, walk_dir
+from deptest.loader import may_define_entries
+from helpers import TempSuite
+
+ENTRY_PATTERN = re.compile(r'^test_')
+
+
+def recursive_walk(dirpath, ignore_patterns):
+    """Top-down walk in one thread, what `walk_dir` should match"""
+    files, dirs = scan_dir(dirpath, ignore_patterns)
+    for path in dirs:
+        files.extend(recursive_walk(path, ignore_patterns))
+    return files
+
+
+class WalkDirTest(unittest.TestCase):
+    def setUp(self):
+        self.dirpath = tempfile.mkdtemp(prefix='deptest-')
+        for path in [
+                'a_test.py', 'test_b.py', 'other.py', 'c/test_c.py', 'c/d/d_test.py',
+                'c/e/test_e.py', 'f/test_f.py', 'f/node_modules/test_g.py', '.git/test_h.py']:
+            self.touch(path)
+        os.symlink(os.path.join(self.dirpath, 'c'), os.path.join(self.dirpath, 'link'))
+
+    def tearDown(self):
+        shutil.rmtree(self.dirpath, ignore_errors=True)
+
+    def touch(self, path):
+        path = os.path.join(self.dirpath, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        open(path, 'w').close()
+
+    def walk(self, ignore_patterns=None, threads=8):
+        found = []
+        walk_dir(self.dirpath, found, ignore_patterns, threads)
+        return [os.path.relpath(i, self.dirpath) for i in found]
+
+    def test_scan_dir(self):
+        files, dirs = scan_dir(self.dirpath, ['.git'])
+        self.assertEqual(files, [os.path.join(self.dirpath, i) for i in 'a_test.py', 'test_b.py'])
+        # symlinks to directories are not followed
+        self.assertEqual(dirs, [os.path.join(self.dirpath, i) for i in 'c', 'f'])
+
+    def test_top_down_order(self):
+        expected = [
+            'a_test.py', 'test_b.py', 'c/test_c.py', 'c/d/d_test.py', 'c/e/test_e.py',
+            'f/test_f.py', 'f/node_modules/test_g.py']
+        self.assertEqual(self.walk(), expected)
+        for threads in 1, 3:
+            self.assertEqual(self.walk(threads=threads), expected)
+        found = []
+        walk_dir(self.dirpath, found)
+        self.assertEqual(found, recursive_walk(self.dirpath, ['.git']))
+
+    def test_ignore(self):
+        self.assertEqual(
+            self.walk(['.git', 'node_modules', '*/c/e', 'test_b*']),
+            ['a_test.py', 'c/test_c.py', 'c/d/d_test.py', 'f/test_f.py'])
+
+
+class PrescanTest(unittest.TestCase):
+    def setUp(self):
+        self.suite = TempSuite({})
+
+    def tearDown(self):
+        self.suite.remove()
+
+    def may_define_entries(self, source):
+        self.suite.write('prescan_test', source)
+        return may_define_entries(os.path.join(self.suite.dirpath, 'prescan_test.py'), ENTRY_PATTERN)
+
+    def test_no_entries(self):
+        self.assertFalse(self.may_define_entries('''
+            import os
+
+            def helper():
+                test = 1
+            '''))
+
+    def test_entries(self):
+        for source in [
+                'def test_a(): pass',
+                'class test_a(object): pass',
+                'test_a = None',
+                'from helpers import test_a',
+                'import test_a',
+                'from helpers import *',
+                # let loading the module report the error
+                'def test_a(',
+        ]:
+            self.assertTrue(self.may_define_entries(source), source)
+
+    def test_dry_run(self):
+        self.suite.write('a_test', 'def test_a(): pass')
+        self.suite.write('helper_test', 'def helper(): pass')
+        os.mkdir(os.path.join(self.suite.dirpath, 'sub'))
+        self.suite.write('sub/test_c', 'def test_c(): pass')
+        run = self.suite.run('--dry', '.')
+        self.assertEqual(run.output.split(), ['./a_test.py', './helper_test.py', './sub/test_c.py'])
+        run = self.suite.run('--dry', '--prescan', '--ignore', 'sub', '.')
+        self.assertEqual(run.output.split(), ['./a_test.py'])
+
+
+if __name__ == '__main__':
+    unittest.main()
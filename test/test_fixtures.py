@@ -0,0 +1,191 @@
+# coding: utf-8
+
+import os
+import json
+import unittest
+
+from deptest.fixtures import FixtureScope, FixtureError, create_fixture
+from helpers import TempSuite
+
+
+FIXTURES = '''
+import json
+from deptest import depend_on, with_setup, fixture, use_fixtures
+from deptest.tools import with_setup as nose_with_setup
+
+events = []
+
+def global_setup():
+    events.append('global_setup')
+
+def global_teardown():
+    events.append('global_teardown')
+
+@fixture(scope='session')
+def conn():
+    events.append('conn up')
+    yield 'conn'
+    events.append('conn down')
+    # torn down last
+    with open('events.json', 'w') as f:
+        json.dump(events, f)
+
+@fixture(scope='module')
+def cache():
+    events.append('cache up')
+    yield {}
+    events.append('cache down')
+
+@fixture()
+def tmp():
+    events.append('tmp up')
+    return 'tmp'
+
+def setup():
+    events.append('setup')
+
+def teardown():
+    events.append('teardown')
+
+@use_fixtures('conn', 'cache', 'tmp')
+@with_setup(setup, teardown)
+def test_a(conn, cache, tmp):
+    cache['a'] = 'a'
+    return 'a'
+
+@depend_on('test_a', with_return=True)
+@use_fixtures('cache', 'tmp')
+def test_b(a, cache, tmp):
+    assert cache['a'] == a
+
+@nose_with_setup(setup, teardown)
+def test_c():
+    events.append('test_c')
+'''
+
+
+class FixtureScopeTest(unittest.TestCase):
+    def test_cached(self):
+        scope = FixtureScope('session')
+        calls = []
+
+        def create(scope):
+            calls.append(1)
+            return 'value'
+        self.assertEqual(scope.get('key', create), 'value')
+        self.assertEqual(scope.get('key', create), 'value')
+        self.assertEqual(len(calls), 1)
+
+    def test_failed_once(self):
+        scope = FixtureScope('session')
+
+        def create(scope):
+            raise ValueError('broken')
+        self.assertRaises(ValueError, scope.get, 'key', create)
+        # not set up again
+        with self.assertRaises(FixtureError) as cm:
+            scope.get('key', lambda scope: 'value')
+        self.assertIn('ValueError: broken', str(cm.exception))
+
+    def test_teardown_order(self):
+        scope = FixtureScope('session')
+        events = []
+
+        def fixture(name):
+            def func():
+                events.append(name + ' up')
+                yield name
+                events.append(name + ' down')
+            return func
+
+        def broken():
+            raise ValueError('broken')
+
+        self.assertEqual(create_fixture(fixture('a'), scope), 'a')
+        scope.add_finalizer(broken)
+        self.assertEqual(create_fixture(fixture('b'), scope), 'b')
+        self.assertEqual(create_fixture(lambda: 'c', scope), 'c')
+        errors = scope.teardown()
+        self.assertEqual(events, ['a up', 'b up', 'b down', 'a down'])
+        # one failing finalizer does not stop the others
+        self.assertEqual(len(errors), 1)
+        self.assertIn('ValueError: broken', errors[0])
+        self.assertEqual(scope.teardown(), [])
+
+    def test_yield_twice(self):
+        def func():
+            yield 1
+            yield 2
+        scope = FixtureScope('session')
+        create_fixture(func, scope)
+        errors = scope.teardown()
+        self.assertIn('yields more than once', errors[0])
+
+
+class FixtureRunTest(unittest.TestCase):
+    def setUp(self):
+        self.suite = TempSuite({'fixtures_test': FIXTURES})
+
+    def tearDown(self):
+        self.suite.remove()
+
+    def events(self):
+        with open(os.path.join(self.suite.dirpath, 'events.json')) as f:
+            return json.load(f)
+
+    def test_scopes(self):
+        run = self.suite.run('fixtures_test.py')
+        self.assertEqual(run.counts, (3, 0, 0), run.output)
+        self.assertEqual(self.events(), [
+            'global_setup', 'conn up', 'cache up', 'tmp up', 'setup', 'teardown',
+            # a fixture of entry scope is set up for each entry
+            'tmp up',
+            'setup', 'test_c', 'teardown',
+            'cache down', 'global_teardown', 'conn down',
+        ])
+
+    def test_scopes_in_threads(self):
+        run = self.suite.run('fixtures_test.py', '--workers', '3')
+        self.assertEqual(run.counts, (3, 0, 0), run.output)
+        events = self.events()
+        self.assertEqual(events.count('conn up'), 1)
+        self.assertEqual(events.count('cache up'), 1)
+        self.assertEqual(events[-3:], ['cache down', 'global_teardown', 'conn down'])
+
+    def test_failures(self):
+        self.suite.write('broken_test', '''
+            from deptest import with_setup, fixture, use_fixtures
+
+            @fixture(scope='module')
+            def broken():
+                raise ValueError('broken fixture')
+
+            @use_fixtures('broken')
+            def test_a(broken):
+                pass
+
+            @use_fixtures('broken')
+            def test_b(broken):
+                pass
+
+            @use_fixtures('missing')
+            def test_c(missing):
+                pass
+
+            def broken_teardown():
+                raise ValueError('broken teardown')
+
+            @with_setup(teardown=broken_teardown)
+            def test_d():
+                pass
+            ''')
+        run = self.suite.run('broken_test.py')
+        self.assertEqual(run.counts, (0, 4, 0), run.output)
+        self.assertEqual(run.output.count('ValueError: broken fixture'), 2, run.output)
+        self.assertIn('FixtureError: broken failed to set up in broken_test', run.output)
+        self.assertIn('unknown fixture: test_c use missing', run.output)
+        self.assertIn('ValueError: broken teardown', run.output)
+
+
+if __name__ == '__main__':
+    unittest.main()
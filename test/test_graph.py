@@ -0,0 +1,89 @@
+# coding: utf-8
+
+import unittest
+
+from helpers import make_graph, names
+
+
+class GraphTest(unittest.TestCase):
+    def setUp(self):
+        #   d
+        #   | \
+        #   b  c   e
+        #   | /    |
+        #   a      f
+        self.graph, self.e = make_graph([
+            ('a', ['b', 'c']),
+            ('b', ['d']),
+            ('c', ['d']),
+            ('d', []),
+            ('e', []),
+            ('f', ['e']),
+        ])
+
+    def test_order(self):
+        order = self.graph.order
+        for entry in order:
+            for dep in self.graph.dependencies[entry]:
+                self.assertLess(order.index(dep), order.index(entry))
+
+    def test_cycle_path(self):
+        with self.assertRaises(ValueError) as cm:
+            make_graph([
+                ('a', ['b']),
+                ('b', ['c']),
+                ('c', ['a']),
+                ('d', ['a']),
+            ])
+        self.assertIn('a -> b -> c -> a', str(cm.exception))
+
+    def test_self_dependency(self):
+        with self.assertRaises(ValueError) as cm:
+            make_graph([('a', ['a'])])
+        self.assertIn('a -> a', str(cm.exception))
+
+    def test_closure(self):
+        e = self.e
+        self.assertEqual(names(self.graph.closure(e['a'])), ['b', 'c', 'd'])
+        self.assertEqual(names(self.graph.closure(e['b'])), ['d'])
+        self.assertEqual(names(self.graph.closure(e['d'])), [])
+        self.assertEqual(names(self.graph.closure_of([e['b'], e['f']])), ['b', 'd', 'e', 'f'])
+
+    def test_reverse_closure(self):
+        e = self.e
+        self.assertEqual(names(self.graph.reverse_closure(e['d'])), ['a', 'b', 'c'])
+        self.assertEqual(names(self.graph.reverse_closure(e['a'])), [])
+
+    def test_deep_chain(self):
+        # closures are built without recursion
+        n = 1000
+        graph, e = make_graph([('n{}'.format(i), ['n{}'.format(i - 1)] if i else []) for i in range(n)])
+        self.assertEqual(len(graph.closure(e['n{}'.format(n - 1)])), n - 1)
+        self.assertEqual(len(graph.reverse_closure(e['n0'])), n - 1)
+
+    def test_components(self):
+        e = self.e
+        components = self.graph.components(self.graph.entries)
+        self.assertEqual([names(i) for i in components], [['a', 'b', 'c', 'd'], ['e', 'f']])
+        # only entries given are connected
+        components = self.graph.components([e['b'], e['c']])
+        self.assertEqual([names(i) for i in components], [['b'], ['c']])
+
+    def test_critical_path(self):
+        e = self.e
+        weights = {e['a']: 1, e['b']: 1, e['c']: 5, e['d']: 2, e['e']: 3, e['f']: 3}
+        total, path = self.graph.critical_path(self.graph.entries, weights)
+        self.assertEqual(total, 8)
+        self.assertEqual(path, [e['d'], e['c'], e['a']])
+
+    def test_critical_path_of_subset(self):
+        e = self.e
+        weights = dict((i, 1) for i in self.graph.entries)
+        total, path = self.graph.critical_path([e['a'], e['b'], e['e']], weights)
+        self.assertEqual(total, 2)
+        self.assertEqual(path, [e['b'], e['a']])
+        self.assertEqual(self.graph.critical_path([], weights), (0, []))
+
+
+if __name__ == '__main__':
+    unittest.main()
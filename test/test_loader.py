@@ -0,0 +1,91 @@
+# coding: utf-8
+
+import os
+import re
+import unittest
+
+from deptest.loader import static_module_from_path, StaticFunction, MODULE_DEPENDENCIES_ATTR
+from helpers import TempSuite
+
+ENTRY_PATTERN = re.compile(r'^test_')
+
+
+class StaticModuleTest(unittest.TestCase):
+    def setUp(self):
+        self.suite = TempSuite({})
+
+    def tearDown(self):
+        self.suite.remove()
+
+    def static_module(self, source):
+        self.suite.write('static_test', source)
+        return static_module_from_path(os.path.join(self.suite.dirpath, 'static_test.py'), ENTRY_PATTERN)
+
+    def test_literal(self):
+        module = self.static_module('''
+            import deptest
+            from deptest import depend_on, module_depend_on
+
+            module_depend_on(['other_test'])
+
+            def test_a():
+                pass
+
+            @depend_on('test_a', with_return=True)
+            @deptest.depend_on('other_test:test_c')
+            def test_b(a):
+                pass
+
+            def helper():
+                pass
+            ''')
+        self.assertIsInstance(module.test_b, StaticFunction)
+        self.assertEqual(module.test_a.dependencies, [])
+        self.assertEqual(module.test_b.dependencies, [
+            {'name': 'other_test:test_c', 'with_return': False},
+            {'name': 'test_a', 'with_return': True},
+        ])
+        self.assertFalse(hasattr(module, 'helper'))
+        self.assertEqual(getattr(module, MODULE_DEPENDENCIES_ATTR), ['other_test'])
+
+    def test_alias(self):
+        self.assertIsNone(self.static_module('''
+            from deptest import depend_on as dep
+
+            def test_a():
+                pass
+
+            @dep('test_a')
+            def test_b():
+                pass
+            '''))
+
+    def test_dynamic(self):
+        for source in [
+                # any other decorator
+                '@other.depend_on("test_a")\ndef test_b(): pass',
+                'import functools\n@functools.wraps(f)\ndef test_b(): pass',
+                '@depend_on(NAME)\ndef test_b(): pass',
+                'module_depend_on(NAMES)',
+                'test_b = make_test()',
+                'from helpers import *',
+        ]:
+            self.assertIsNone(self.static_module(source), source)
+
+    def test_collect_only(self):
+        self.suite.write('alias_test', '''
+            from deptest import depend_on as dep
+
+            def test_a():
+                pass
+
+            @dep('test_a')
+            def test_b():
+                pass
+            ''')
+        run = self.suite.run('--collect-only', 'alias_test.py')
+        self.assertIn('alias_test.test_b <- alias_test.test_a\n', run.output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+# coding: utf-8
+
+import pickle
+import logging
+import threading
+import unittest
+
+from deptest.log import MyMemoryHandler, FilterSet
+
+
+def make_record(name, msg, *args):
+    return logging.LogRecord(name, logging.WARNING, __file__, 0, msg, args, None)
+
+
+class MemoryHandlerTest(unittest.TestCase):
+    def setUp(self):
+        self.handler = MyMemoryHandler('%(name)s: %(message)s', capacity=3)
+
+    def test_capacity(self):
+        for i in range(5):
+            self.handler.handle(make_record('a', 'record %s', i))
+        self.assertEqual(self.handler.formatted(), ['a: record 2', 'a: record 3', 'a: record 4'])
+        self.handler.truncate()
+        self.assertEqual(self.handler.formatted(), [])
+
+    def test_format_lazily(self):
+        class Arg(object):
+            formatted = 0
+
+            def __str__(self):
+                Arg.formatted += 1
+                return 'arg'
+
+        for i in range(5):
+            self.handler.handle(make_record('a', '%s', Arg()))
+        self.assertEqual(Arg.formatted, 0)
+        self.assertEqual(self.handler.formatted(), ['a: arg'] * 3)
+        self.assertEqual(Arg.formatted, 3)
+
+    def test_excluded(self):
+        self.handler.handle(make_record('deptest.core', 'excluded'))
+        self.handler.handle(make_record('deptestx', 'kept'))
+        self.assertEqual(self.handler.formatted(), ['deptestx: kept'])
+
+    def test_threaded(self):
+        self.handler.handle(make_record('a', 'shared'))
+        formatted = {}
+
+        def run(name):
+            self.handler.handle(make_record(name, 'record'))
+            formatted[name] = self.handler.formatted()
+
+        with self.handler.threaded():
+            threads = [threading.Thread(target=run, args=(i,)) for i in 'bc']
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(formatted, {'b': ['b: record'], 'c': ['c: record']})
+        self.assertEqual(self.handler.formatted(), ['a: shared'])
+
+    def test_pickle(self):
+        self.handler.handle(make_record('a', 'record'))
+        handler = pickle.loads(pickle.dumps(self.handler))
+        # records stay behind
+        self.assertEqual(handler.formatted(), [])
+        handler.handle(make_record('a', 'record'))
+        self.assertEqual(handler.formatted(), ['a: record'])
+        self.assertEqual(handler.buffer.maxlen, 3)
+
+
+class FilterSetTest(unittest.TestCase):
+    def test_prefixes(self):
+        filterset = FilterSet(['a.b', 'c', '-a.b.x', '-d'])
+        for name in 'a.b', 'a.b.y', 'c', 'c.d':
+            self.assertTrue(filterset.allow(name), name)
+        for name in 'a', 'a.bc', 'a.b.x', 'a.b.x.y', 'cd', 'd':
+            self.assertFalse(filterset.allow(name), name)
+
+    def test_exclusive_only(self):
+        filterset = FilterSet(['-a'])
+        self.assertTrue(filterset.allow('b'))
+        self.assertTrue(filterset.allow('ab'))
+        self.assertFalse(filterset.allow('a.b'))
+        self.assertTrue(FilterSet([]).allow('a'))
+
+    def test_special_characters(self):
+        filterset = FilterSet(['a+b'])
+        self.assertTrue(filterset.allow('a+b'))
+        self.assertFalse(filterset.allow('aab'))
+
+    def test_cached(self):
+        filterset = FilterSet(['a'])
+        self.assertTrue(filterset.allow('a.b'))
+        self.assertFalse(filterset.allow('b'))
+        self.assertEqual(filterset._decisions, {'a.b': True, 'b': False})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,214 @@
+# coding: utf-8
+
+import os
+import json
+import unittest
+
+from helpers import TempSuite
+
+
+CHAIN = '''
+from deptest import depend_on
+
+@depend_on('test_c', with_return=True)
+@depend_on('test_b', with_return=True)
+def test_a(b, c):
+    assert (b, c) == ('b', 'c')
+
+@depend_on('test_d', with_return=True)
+def test_b(d):
+    assert d == 'd'
+    return 'b'
+
+@depend_on('test_d')
+def test_c():
+    return 'c'
+
+def test_d():
+    return 'd'
+'''
+
+SPREAD = '''
+import logging
+from deptest import depend_on
+
+def test_root():
+    print 'root output'
+    logging.warning('root logging')
+
+@depend_on('test_root')
+def test_broken():
+    assert False
+
+@depend_on('test_broken')
+def test_child():
+    pass
+
+@depend_on('test_child')
+def test_grandchild():
+    pass
+
+@depend_on('test_root')
+def test_sibling():
+    pass
+'''
+
+
+class RunTest(unittest.TestCase):
+    def setUp(self):
+        self.suite = TempSuite({'chain_test': CHAIN, 'spread_test': SPREAD})
+
+    def tearDown(self):
+        self.suite.remove()
+
+    def test_return_values(self):
+        for args in [], ['--workers', '3'], ['--processes', '2']:
+            run = self.suite.run('chain_test.py', *args)
+            self.assertEqual(run.counts, (4, 0, 0), run.output)
+
+    def test_unmet_spread(self):
+        for args in [], ['--workers', '3'], ['--processes', '2']:
+            run = self.suite.run('spread_test.py', *args)
+            self.assertEqual(run.counts, (2, 1, 2), run.output)
+            self.assertEqual(run.status_of('test_broken'), 'FAILED')
+            self.assertEqual(run.status_of('test_child'), 'UNMET')
+            self.assertEqual(run.status_of('test_grandchild'), 'UNMET')
+
+    def test_select_entry(self):
+        # dependencies of a selected entry are run too
+        run = self.suite.run('chain_test.py:test_b')
+        self.assertEqual(run.counts, (2, 0, 0), run.output)
+        self.assertIsNone(run.status_of('test_a'))
+
+    def test_jsonl_output(self):
+        for args in [], ['--workers', '2'], ['--processes', '2']:
+            path = os.path.join(self.suite.dirpath, 'results.jsonl')
+            self.suite.run('spread_test.py', '--jsonl', path, *args)
+            with open(path) as f:
+                records = dict((i['name'], i) for i in map(json.loads, f))
+            root = records['spread_test:test_root']
+            self.assertEqual(root['captured_stdout'], 'root output\n', args)
+            self.assertEqual(root['captured_logging'], ['root: WARNING: root logging'], args)
+
+    def test_logging_filter(self):
+        self.suite.write('logging_test', '''
+            import logging
+
+            def test_log():
+                logging.getLogger('app').warning('app')
+                logging.getLogger('app.db').warning('app.db')
+                logging.getLogger('lib').warning('lib')
+                assert False
+            ''')
+        run = self.suite.run('logging_test.py', '--logging-filter', 'app,-app.db')
+        self.assertIn('app: WARNING: app\n', run.output)
+        self.assertNotIn('app.db: WARNING', run.output)
+        self.assertNotIn('lib: WARNING', run.output)
+
+    def test_output_tail(self):
+        self.suite.write('noisy_test', '''
+            def test_noisy():
+                for i in range(10):
+                    print 'line', i
+                assert False
+
+            def test_passing():
+                print 'passing output'
+            ''')
+        for args in [], ['--workers', '2'], ['--processes', '2']:
+            run = self.suite.run('noisy_test.py', '--output-tail', '2', *args)
+            self.assertIn('... 8 lines truncated ...\nline 8\nline 9\n', run.output, args)
+            self.assertNotIn('passing output', run.output, args)
+
+    def test_capture_fd(self):
+        self.suite.write('fd_test', '''
+            # coding: utf-8
+            import os
+
+            def test_fd():
+                print u'café'
+                os.system('echo from a subprocess')
+                assert False
+            ''')
+        for args in [], ['--processes', '2']:
+            run = self.suite.run('fd_test.py', '--capture', 'fd', *args)
+            self.assertEqual(run.counts, (0, 1, 0), run.output)
+            self.assertIn('café\nfrom a subprocess\n', run.output, args)
+
+    def test_generator_failures(self):
+        self.suite.write('generator_test', '''
+            import time
+            from deptest import depend_on
+
+            def check(i):
+                print 'case', i
+                time.sleep(0.01)
+                assert i not in (3, 11)
+
+            def test_gen():
+                for i in range(20):
+                    yield check, i
+
+            @depend_on('test_gen')
+            def test_after():
+                pass
+
+            def test_broken_gen():
+                yield check, 0
+                raise ValueError('broken generator')
+            ''')
+        for args in [], ['--sub-workers', '4'], ['--workers', '2', '--sub-workers', '3'], ['--processes', '2']:
+            run = self.suite.run('generator_test.py', *args)
+            self.assertEqual(run.counts, (0, 2, 1), run.output)
+            self.assertIn('2 of 20 cases failed', run.output, args)
+            # reports in the order of the cases, each with its own output
+            self.assertRegexpMatches(
+                run.output,
+                r'- check\(3\)\n(?:.*\n)*?case 3\n(?:.*\n)*?- check\(11\)\n(?:.*\n)*?case 11\n')
+            for i in range(20):
+                if i not in (3, 11):
+                    self.assertNotIn('case {}\n'.format(i), run.output, args)
+            self.assertIn('ValueError: broken generator', run.output, args)
+
+    def test_maxfail(self):
+        for args in [], ['--processes', '2']:
+            run = self.suite.run('-x', '--durations', '3', 'spread_test.py', *args)
+            self.assertEqual(run.returncode, 0, run.output)
+            self.assertEqual(run.counts, (1, 1, 0), run.output)
+            self.assertIn('Stopped, --maxfail 1 reached', run.output)
+            self.assertIn('3 not run', run.output)
+            self.assertIn('Critical path', run.output)
+        run = self.suite.run('--maxfail', '2', 'spread_test.py')
+        self.assertEqual(run.counts, (2, 1, 2), run.output)
+        self.assertNotIn('Stopped', run.output)
+
+    def test_cached_entry_of_failed_dependency(self):
+        self.suite.write('cached_test', '''
+            import os
+            import threading
+            from deptest import depend_on
+
+            def test_a():
+                assert not os.path.exists('fail')
+                # can not be pickled, so test_b always runs
+                return threading.Lock()
+
+            @depend_on('test_a', with_return=True)
+            def test_b(lock):
+                pass
+
+            @depend_on('test_b')
+            def test_c():
+                pass
+            ''')
+        run = self.suite.run('--incremental', 'cached_test.py')
+        self.assertEqual(run.counts, (3, 0, 0), run.output)
+        open(os.path.join(self.suite.dirpath, 'fail'), 'w').close()
+        run = self.suite.run('--incremental', 'cached_test.py')
+        self.assertEqual(run.counts, (0, 1, 2), run.output)
+        self.assertEqual(run.status_of('test_c'), 'UNMET')
+        self.assertIn('0 cached', run.output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,209 @@
+# coding: utf-8
+
+import random
+import unittest
+
+from deptest.scheduler import Scheduler, partition, merge_conflicting, select_within_budget
+from helpers import make_graph, names
+
+
+def drain(scheduler):
+    """Pop and mark done one entry at a time, returns the order"""
+    order = []
+    entry = scheduler.pop()
+    while entry is not None:
+        order.append(entry)
+        scheduler.done(entry)
+        entry = scheduler.pop()
+    return order
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.graph, self.e = make_graph([
+            ('a', ['b', 'c']),
+            ('b', ['d']),
+            ('c', ['d']),
+            ('d', []),
+            ('e', []),
+        ])
+
+    def test_exactly_once_in_dependency_order(self):
+        order = drain(Scheduler(self.graph, self.graph.entries))
+        self.assertEqual(names(order), names(self.graph.entries))
+        for entry in order:
+            for dep in self.graph.dependencies[entry]:
+                self.assertLess(order.index(dep), order.index(entry))
+
+    def test_order_by_index(self):
+        e = self.e
+        order = drain(Scheduler(self.graph, self.graph.entries))
+        self.assertEqual(order, [e['d'], e['b'], e['c'], e['a'], e['e']])
+
+    def test_priorities(self):
+        e = self.e
+        order = drain(Scheduler(self.graph, self.graph.entries, {e['e']: 0, e['d']: 1}))
+        self.assertEqual(order[0], e['e'])
+
+    def test_not_ready_before_done(self):
+        e = self.e
+        scheduler = Scheduler(self.graph, self.graph.entries)
+        self.assertEqual(scheduler.pop(), e['d'])
+        self.assertEqual(scheduler.pop(), e['e'])
+        # b and c wait for d
+        self.assertIsNone(scheduler.pop())
+        scheduler.done(e['e'])
+        self.assertIsNone(scheduler.pop())
+        scheduler.done(e['d'])
+        self.assertEqual(scheduler.pop(), e['b'])
+        self.assertEqual(scheduler.pop(), e['c'])
+        scheduler.done(e['b'])
+        self.assertIsNone(scheduler.pop())
+        scheduler.done(e['c'])
+        self.assertEqual(scheduler.pop(), e['a'])
+
+    def test_subset(self):
+        # dependencies left out of the entries are not waited for
+        e = self.e
+        order = drain(Scheduler(self.graph, [e['a'], e['b']]))
+        self.assertEqual(order, [e['b'], e['a']])
+
+
+class ResourceTest(unittest.TestCase):
+    def setUp(self):
+        self.graph, self.e = make_graph([
+            ('w1', [], [('db', 'write')]),
+            ('r1', [], [('db', 'read')]),
+            ('r2', [], [('db', 'read')]),
+            ('w2', [], [('db', 'write')]),
+            ('other', [], [('cache', 'write')]),
+        ])
+
+    def test_writer_is_exclusive(self):
+        e = self.e
+        scheduler = Scheduler(self.graph, self.graph.entries)
+        self.assertEqual(scheduler.pop(), e['w1'])
+        # every other user of db conflicts
+        self.assertEqual(scheduler.pop(), e['other'])
+        self.assertIsNone(scheduler.pop())
+        scheduler.done(e['w1'])
+        self.assertEqual(scheduler.pop(), e['r1'])
+
+    def test_readers_share(self):
+        e = self.e
+        scheduler = Scheduler(self.graph, [e['r1'], e['r2'], e['w2']])
+        self.assertEqual(scheduler.pop(), e['r1'])
+        self.assertEqual(scheduler.pop(), e['r2'])
+        self.assertIsNone(scheduler.pop())
+        scheduler.done(e['r1'])
+        self.assertIsNone(scheduler.pop())
+        scheduler.done(e['r2'])
+        self.assertEqual(scheduler.pop(), e['w2'])
+
+    def test_exactly_once(self):
+        order = drain(Scheduler(self.graph, self.graph.entries))
+        self.assertEqual(names(order), names(self.graph.entries))
+        self.assertEqual(Scheduler(self.graph, []).pop(), None)
+
+    def test_merge_conflicting(self):
+        e = self.e
+        components = [[e['w1']], [e['r1']], [e['other']], [e['r2']]]
+        merged = merge_conflicting(components)
+        self.assertEqual([names(i) for i in merged], [['r1', 'r2', 'w1'], ['other']])
+        # readers alone never conflict
+        self.assertEqual(len(merge_conflicting([[e['r1']], [e['r2']]])), 2)
+
+
+class PartitionTest(unittest.TestCase):
+    def test_balanced(self):
+        groups = [[5], [4], [3], [3], [2], [1]]
+        bins, totals = partition(groups, sum, 2)
+        self.assertEqual(sorted(totals), [9, 9])
+        self.assertEqual(sorted(sum(bins, [])), sorted(groups))
+
+    def test_deterministic(self):
+        groups = [[1], [1], [1], [1]]
+        self.assertEqual(partition(groups, sum, 3), partition(groups, sum, 3))
+
+
+class BudgetTest(unittest.TestCase):
+    def setUp(self):
+        #   a -> b -> c,  d,  e
+        self.graph, self.e = make_graph([
+            ('a', []),
+            ('b', ['a']),
+            ('c', ['b']),
+            ('d', []),
+            ('e', []),
+        ])
+        self.costs = {'a': 1, 'b': 1, 'c': 1, 'd': 2, 'e': 10}
+        self.values = {'a': 1, 'b': 1, 'c': 4, 'd': 1, 'e': 1}
+
+    def select(self, budget):
+        return select_within_budget(
+            self.graph, self.graph.entries,
+            lambda i: self.costs[i._entry_name], lambda i: self.values[i._entry_name], budget)
+
+    def test_closure_is_kept(self):
+        selected, total = self.select(3)
+        self.assertEqual(names(selected), ['a', 'b', 'c'])
+        self.assertEqual(total, 3)
+
+    def test_fits_budget(self):
+        for budget in range(16):
+            selected, total = self.select(budget)
+            self.assertLessEqual(total, budget)
+            self.assertEqual(total, sum(self.costs[i._entry_name] for i in selected))
+            for entry in selected:
+                self.assertTrue(self.graph.closure(entry) <= selected)
+
+    def test_everything(self):
+        selected, total = self.select(100)
+        self.assertEqual(len(selected), 5)
+        self.assertEqual(total, 15)
+
+    def test_nothing_fits(self):
+        self.assertEqual(self.select(0.5), (set(), 0))
+
+    def test_same_as_full_greedy(self):
+        for seed in range(20):
+            rand = random.Random(seed)
+            spec = []
+            for i in range(60):
+                deps = rand.sample(range(i), min(i, rand.randint(0, 2)))
+                spec.append(('n{}'.format(i), ['n{}'.format(j) for j in deps]))
+            graph, e = make_graph(spec)
+            costs = dict((i, rand.randint(1, 5)) for i in graph.entries)
+            values = dict((i, rand.choice([1, 2, 4])) for i in graph.entries)
+            budget = rand.randint(10, 100)
+            self.assertEqual(
+                select_within_budget(graph, graph.entries, costs.get, values.get, budget),
+                full_greedy(graph, graph.entries, costs.get, values.get, budget))
+
+
+def full_greedy(graph, entries, cost, value, budget):
+    """`select_within_budget` computing every candidate again for each pick"""
+    selected = set()
+    total = 0
+    candidates = set(entries)
+    while candidates:
+        best = None
+        for entry in candidates:
+            group = (graph.closure(entry) | set([entry])) - selected
+            group_cost = sum(cost(i) for i in group)
+            if total + group_cost > budget:
+                continue
+            ratio = sum(value(i) for i in group) / float(group_cost)
+            key = (-ratio, graph.index[entry])
+            if best is None or key < best[0]:
+                best = (key, group, group_cost)
+        if best is None:
+            break
+        selected |= best[1]
+        total += best[2]
+        candidates -= best[1]
+    return selected, total
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+# coding: utf-8
+
+import unittest
+
+from deptest.store import ReturnStore, deep_sizeof
+from helpers import Entry
+
+
+class ReturnStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.a, self.b, self.c = Entry('a'), Entry('b'), Entry('c')
+
+    def test_release_on_last_consumer(self):
+        store = ReturnStore({self.a: 2}, measure=True)
+        value = range(100)
+        store.put(self.a, value)
+        # nobody takes the value of b
+        store.put(self.b, 'b')
+        self.assertIsNone(store.get(self.b))
+        self.assertEqual(store.retained, deep_sizeof(value))
+        store.release(self.a)
+        self.assertIs(store.get(self.a), value)
+        store.release(self.a)
+        self.assertIsNone(store.get(self.a))
+        self.assertEqual(store.retained, 0)
+        self.assertEqual(store.peak, deep_sizeof(value))
+
+    def test_not_measured(self):
+        store = ReturnStore({self.a: 1})
+        store.put(self.a, range(100))
+        self.assertEqual(store.get(self.a), range(100))
+        self.assertEqual((store.retained, store.peak), (0, 0))
+        store.release(self.a)
+        self.assertIsNone(store.get(self.a))
+
+    def test_spill_and_reload(self):
+        store = ReturnStore({self.a: 2, self.b: 1}, spill_size=1000)
+        big = {'key': range(1000)}
+        store.put(self.a, big)
+        store.put(self.b, 'small')
+        self.assertEqual(store.spilled_count, 1)
+        self.assertEqual(store.retained, deep_sizeof('small'))
+        # each dependent gets its own copy
+        first, second = store.get(self.a), store.get(self.a)
+        self.assertEqual(first, big)
+        self.assertIsNot(first, second)
+        self.assertEqual(store.get(self.b), 'small')
+        store.release(self.a)
+        store.release(self.a)
+        self.assertIsNone(store.get(self.a))
+
+    def test_spill_not_picklable(self):
+        store = ReturnStore({self.a: 1}, spill_size=10)
+        value = [lambda: None] * 10
+        store.put(self.a, value)
+        self.assertIs(store.get(self.a), value)
+        self.assertEqual(store.spilled_count, 0)
+
+    def test_take_when_watched(self):
+        old = ReturnStore({self.a: 1, self.b: 1}, spill_size=1000, keep=True)
+        old.put(self.a, 'a')
+        old.put(self.b, range(1000))
+        # kept after the dependents finished, for the next run
+        old.release(self.a)
+        self.assertEqual(old.get(self.a), 'a')
+
+        new = ReturnStore({self.c: 1, self.b: 1}, spill_size=1000, keep=True)
+        new_a = Entry('a')
+        new.take(new_a, old, self.a)
+        new.take(self.b, old, self.b)
+        # nothing to take
+        new.take(self.c, old, self.c)
+        self.assertEqual(new.get(new_a), 'a')
+        self.assertEqual(new.get(self.b), range(1000))
+        self.assertIsNone(new.get(self.c))
+        self.assertIsNone(old.get(self.a))
+        self.assertEqual(old.retained, 0)
+        self.assertEqual(new.retained, deep_sizeof('a'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+# coding: utf-8
+
+import time
+import signal
+import unittest
+
+from deptest.timeout import Watchdog, EntryTimeout
+from helpers import TempSuite
+
+
+def racing_entries(n, seconds, sleep):
+    """Entries that finish right after their deadlines, so that the
+    watchdog interrupts some of them as they return
+    """
+    lines = ['import time', 'from deptest import timeout', '']
+    for i in range(n):
+        lines.extend([
+            '@timeout({})'.format(seconds),
+            'def test_{}():'.format(i),
+            '    time.sleep({})'.format(sleep),
+            '',
+        ])
+    return '\n'.join(lines)
+
+
+class WatchdogTest(unittest.TestCase):
+    def setUp(self):
+        self.handler = signal.getsignal(signal.SIGALRM)
+        self.watchdog = Watchdog()
+        self.watchdog.start()
+
+    def tearDown(self):
+        self.watchdog.stop()
+        signal.signal(signal.SIGALRM, self.handler)
+
+    def wait_fired(self):
+        while not self.watchdog.fired:
+            time.sleep(0.01)
+        # let the signal be handled
+        time.sleep(0.05)
+
+    def test_interrupt_call(self):
+        self.watchdog.watch(time.time() + 0.05, 'in call')
+        with self.assertRaises(EntryTimeout):
+            with self.watchdog.calling():
+                time.sleep(10)
+        self.assertEqual(self.watchdog.unwatch(), 'in call')
+
+    def test_alarm_after_call(self):
+        # the entry returned before the alarm came
+        self.watchdog.watch(time.time() - 1, 'after call')
+        with self.watchdog.calling():
+            pass
+        self.wait_fired()
+        self.assertEqual(self.watchdog.unwatch(), 'after call')
+
+    def test_unwatched(self):
+        self.watchdog.watch(time.time() + 10, 'not reached')
+        with self.watchdog.calling():
+            pass
+        self.assertIsNone(self.watchdog.unwatch())
+
+
+class TimeoutTest(unittest.TestCase):
+    def setUp(self):
+        self.suite = TempSuite({
+            'race_test': racing_entries(100, 0.02, 0.025),
+            'hang_test': '''
+                import time
+                from deptest import depend_on
+
+                def test_hang():
+                    time.sleep(60)
+
+                @depend_on('test_hang')
+                def test_after():
+                    pass
+
+                def test_other():
+                    pass
+                ''',
+        })
+
+    def tearDown(self):
+        self.suite.remove()
+
+    def test_deadline_race(self):
+        for args in [], ['--workers', '4']:
+            run = self.suite.run('race_test.py', *args, kill_after=60)
+            self.assertEqual(run.returncode, 0, run.output)
+            self.assertEqual(run.total, 100, run.output)
+            self.assertEqual(run.unmet, 0, run.output)
+            # every failure is a timeout of the entry itself
+            self.assertEqual(run.output.count('timed out after 0.02s\n'), run.failed, run.output)
+
+    def test_hung_entry(self):
+        for args in [], ['--workers', '2']:
+            run = self.suite.run('hang_test.py', '--timeout', '0.5', *args, kill_after=30)
+            self.assertEqual(run.counts, (1, 1, 1), run.output)
+            self.assertIn('hang_test:test_hang timed out after 0.5s', run.output)
+
+    def test_cancel_processes(self):
+        self.suite.write('first_test', '''
+            def test_first():
+                pass
+            ''')
+        self.suite.write('stuck_test', '''
+            import time
+            import signal
+            from deptest import depend_on
+
+            @depend_on('first_test:test_first')
+            def test_stuck():
+                # the watchdog of the worker can not interrupt it
+                signal.signal(signal.SIGALRM, signal.SIG_IGN)
+                time.sleep(60)
+
+            @depend_on('test_stuck')
+            def test_after():
+                pass
+            ''')
+        self.suite.run('--incremental', 'first_test.py')
+        run = self.suite.run(
+            '--incremental', '--processes', '2', '--global-timeout', '1', 'first_test.py', 'stuck_test.py',
+            kill_after=30)
+        # entries of the killed worker are reported, including cached ones
+        self.assertEqual(run.counts, (0, 2, 0), run.output)
+        self.assertIn('1 cached', run.output)
+        self.assertNotIn('not run', run.output)
+        self.assertNotIn('--maxfail', run.output)
+        self.assertEqual(run.status_of('test_first'), 'OK (cached)')
+        self.assertEqual(run.output.count('cancelled, --global-timeout reached'), 2, run.output)
+
+
+if __name__ == '__main__':
+    unittest.main()
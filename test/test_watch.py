@@ -0,0 +1,93 @@
+# coding: utf-8
+
+import os
+import re
+import time
+import threading
+import unittest
+
+from helpers import TempSuite
+
+
+WATCHED = '''
+from deptest import depend_on
+
+def test_a():
+    return 'a'
+
+@depend_on('test_a', with_return=True)
+def test_b(a):
+    assert a == 'a'
+
+@depend_on('test_b')
+def test_c():
+    pass
+
+def test_d():
+    pass
+'''
+
+summary_re = re.compile(r'Ran (\d+) tests, OK (\d+), FAILED (\d+), UNMET (\d+)')
+
+
+class WatchTest(unittest.TestCase):
+    def setUp(self):
+        self.suite = TempSuite({'watched_test': WATCHED})
+
+    def tearDown(self):
+        self.suite.remove()
+
+    def change_later(self, source, name='watched_test'):
+        """Write `source` into module `name` once the first run is over"""
+        def change():
+            path = os.path.join(self.suite.dirpath, name + '.py')
+            self.suite.write(name, source)
+            # the new mtime may fall in the same second as the old one
+            mtime = time.time() + 10
+            os.utime(path, (mtime, mtime))
+        timer = threading.Timer(1, change)
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+    def run_watch(self, *args):
+        run = self.suite.run(
+            '--watch', '--watch-interval', '0.1', 'watched_test.py', *args, interrupt_after=2.5)
+        return [tuple(map(int, i)) for i in summary_re.findall(run.output)], run.output
+
+    def test_rerun_changed(self):
+        # states of test_a and test_d are kept, test_b still gets the return value of test_a
+        self.change_later(WATCHED.replace("assert a == 'a'", "assert a == 'a', a"))
+        summaries, output = self.run_watch()
+        # kept states are counted in the summary too
+        self.assertEqual(summaries, [(4, 4, 0, 0), (4, 4, 0, 0)], output)
+        rerun = output.split('Watching for changes')[1]
+        self.assertIn('watched_test.test_b...', rerun)
+        self.assertIn('watched_test.test_c...', rerun)
+        self.assertNotIn('watched_test.test_a...', rerun)
+        self.assertNotIn('watched_test.test_d...', rerun)
+
+    def test_unchanged(self):
+        self.change_later(WATCHED)
+        summaries, output = self.run_watch()
+        self.assertEqual(summaries, [(4, 4, 0, 0)], output)
+        self.assertIn('No entries changed', output)
+
+    def test_helper_changed(self):
+        # modules using a changed helper module are run again
+        self.suite.write('helper', "VALUE = 'a'")
+        self.suite.write('helper_test', '''
+            import helper
+
+            def test_e():
+                assert helper.VALUE == 'a'
+            ''')
+        self.change_later("VALUE = 'b'", 'helper')
+        summaries, output = self.run_watch('helper_test.py')
+        self.assertEqual(summaries, [(5, 5, 0, 0), (5, 4, 1, 0)], output)
+        rerun = output.split('Watching for changes')[1]
+        self.assertIn('helper_test.test_e... FAILED', rerun)
+        self.assertNotIn('watched_test.', rerun)
+
+
+if __name__ == '__main__':
+    unittest.main()